@@ -1,17 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, jsonify, Response, stream_with_context, send_file
 import os
+import logging
 from dotenv import load_dotenv
-import requests
-import json
-from requests.exceptions import RequestException, Timeout
 import urllib3
+from markupsafe import Markup
 import sys
+import threading
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from datetime import datetime
-import sqlite3
 from pathlib import Path
+from avatar_cache import CatalogCache, CatalogError
+from avatar_index import AvatarIndex, DEFAULT_PER_PAGE
+from heygen_client import HeygenClient, HeygenError, CircuitOpenError, DEFAULT_BASE_URL
+from job_queue import JobQueue, new_idempotency_key
+from key_pool import KeyPool
+from media_cache import MediaCache, MediaError
+from logging_config import configure_logging
+from metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram, start_timings, finish_timings
+from response_cache import FragmentCache, ResponseCompressor
+from video_batches import VideoBatches, BatchError, build_video_payload, parse_batch_file, payload_details, validate_rows
+from status_poller import StatusPoller, RECONCILE_SCHEDULE, DEFAULT_SCHEDULE, parse_timestamp, status_error
+from video_events import VideoEventBroker
+from video_analytics import PipelineAnalytics
+from video_store import VideoStore, UNPOLLED_STATUSES, QUEUED_STATUS, VIDEO_SORTS, encode_keyset, decode_keyset
+from video_sync import VideoListSync
+from video_mirror import VideoMirror
+from webhooks import WebhookReceiver, WebhookError
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -19,191 +33,429 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Load environment variables
 load_dotenv()
 
-# Configure Heygen API
+logger = logging.getLogger(__name__)
+
+# Configure Heygen API; HEYGEN_API_KEYS lists one key per account
 HEYGEN_API_KEY = os.getenv('HEYGEN_API_KEY')
+HEYGEN_API_KEYS = [key.strip() for key in os.getenv('HEYGEN_API_KEYS', '').split(',') if key.strip()] \
+    or [HEYGEN_API_KEY]
+key_pool = KeyPool(HEYGEN_API_KEYS, refresh_interval=int(os.getenv('KEY_QUOTA_REFRESH_INTERVAL', 300)))
 
-# Configure requests session with retry logic
-session = requests.Session()
-retry_strategy = Retry(
-    total=3,  # number of retries
-    backoff_factor=1,  # wait 1, 2, 4 seconds between retries
-    status_forcelist=[500, 502, 503, 504]  # HTTP status codes to retry on
+# One pooled client for every upstream call
+heygen = HeygenClient(
+    key_pool,
+    base_url=os.getenv('HEYGEN_API_BASE', DEFAULT_BASE_URL),
+    max_concurrency=int(os.getenv('HEYGEN_MAX_CONCURRENCY', 8)),
+    verify=os.getenv('HEYGEN_VERIFY_SSL', '0') == '1',
+    failure_threshold=int(os.getenv('HEYGEN_CIRCUIT_FAILURES', 5)),
+    reset_timeout=float(os.getenv('HEYGEN_CIRCUIT_RESET', 30))
 )
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+
+key_pool.fetch_quota = heygen.get_remaining_quota
+
+def fetch_video_status(video_id):
+    """video_status.get with the key of the account that owns the video"""
+    return heygen.get_video_status(video_id, key_id=video_store.api_key_id(video_id))
 
 # Database setup
-DB_PATH = Path(__file__).parent / 'videos.db'
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS videos (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            status TEXT,
-            thumbnail_url TEXT,
-            video_url TEXT,
-            created_at TIMESTAMP,
-            updated_at TIMESTAMP,
-            duration TEXT,
-            error TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Initialize database
-init_db()
-
-def test_api_connection():
-    """Test the connection to Heygen API"""
-    print("\nTesting Heygen API connection...")
-    print(f"API Key being used: {HEYGEN_API_KEY}")
-    
-    headers = {
-        'x-api-key': HEYGEN_API_KEY,
-        'accept': 'application/json'
-    }
-    
+DB_PATH = Path(os.getenv('VIDEOS_DB_PATH', Path(__file__).parent / 'videos.db'))
+video_store = VideoStore(DB_PATH)
+
+# Avatar catalog shared by every route; refreshed in the background after the TTL
+avatar_cache = CatalogCache(
+    heygen.get_avatars,
+    ttl=int(os.getenv('AVATAR_CACHE_TTL', 300)),
+    max_stale=int(os.getenv('AVATAR_CACHE_MAX_STALE', 3600)),
+    name='avatars',
+    build=AvatarIndex
+)
+
+def voice_id_set(data, version):
+    return {voice.get('voice_id') for voice in data.get('data', {}).get('voices', []) or []}
+
+# Voice catalog, used to validate batch uploads before anything is queued
+voice_cache = CatalogCache(
+    heygen.get_voices,
+    ttl=int(os.getenv('AVATAR_CACHE_TTL', 300)),
+    max_stale=int(os.getenv('AVATAR_CACHE_MAX_STALE', 3600)),
+    name='voices',
+    build=voice_id_set
+)
+
+# Status changes are pushed to browsers over /events/videos
+video_events = VideoEventBroker()
+
+# Completed videos are downloaded here so replays are served locally
+video_mirror = VideoMirror(
+    video_store,
+    os.getenv('VIDEO_MIRROR_DIR', Path(__file__).parent / 'video_mirror'),
+    max_bytes=int(os.getenv('VIDEO_MIRROR_MAX_MB', 2048)) * 1024 * 1024,
+    fetch_status=fetch_video_status
+)
+
+# Served by nginx when set, e.g. "/protected/videos/" mapped to VIDEO_MIRROR_DIR
+VIDEO_MIRROR_ACCEL_PREFIX = os.getenv('VIDEO_MIRROR_ACCEL_PREFIX', '')
+
+def on_status_change(changes):
+    video_events.publish_many(changes)
+    if any(change['status'] == 'COMPLETED' for change in changes):
+        video_mirror.wake()
+
+# Heygen calls /webhooks/heygen when a video finishes; requests signed with this secret
+HEYGEN_WEBHOOK_SECRET = os.getenv('HEYGEN_WEBHOOK_SECRET', '')
+
+# Single server-side poller for every in-flight video, shared by all browser tabs.
+# With webhooks it only reconciles callbacks that never arrived.
+status_poller = StatusPoller(video_store, fetch_video_status,
+                             schedule=RECONCILE_SCHEDULE if HEYGEN_WEBHOOK_SECRET else DEFAULT_SCHEDULE,
+                             on_change=on_status_change)
+
+def on_webhook_change(changes):
+    for change in changes:
+        status_poller.untrack(change['id'])
+    on_status_change(changes)
+
+webhook_receiver = WebhookReceiver(video_store, HEYGEN_WEBHOOK_SECRET, on_change=on_webhook_change)
+
+# Pulls new upstream videos into videos.db in the background
+video_sync = VideoListSync(video_store, heygen.list_videos,
+                           interval=int(os.getenv('VIDEO_SYNC_INTERVAL', 60)),
+                           accounts=[key.id for key in key_pool.keys] or [None])
+
+# Local copies of avatar previews and video thumbnails, served by /media/thumb
+media_cache = MediaCache(
+    os.getenv('MEDIA_CACHE_DIR', Path(__file__).parent / 'media_cache'),
+    max_bytes=int(os.getenv('MEDIA_CACHE_MAX_MB', 256)) * 1024 * 1024
+)
+
+# Rendered avatar pages and video cards, plus gzip/brotli for HTML, JSON and static/
+fragment_cache = FragmentCache(max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)))
+compressor = ResponseCompressor(level=int(os.getenv('COMPRESSION_LEVEL', 6)))
+COMPRESSION_ENABLED = os.getenv('COMPRESSION', '1') == '1'
+
+def queued_video_id(job_id):
+    """Placeholder videos.db id for a submission that has not reached Heygen yet"""
+    return f"queued-{job_id}"
+
+def dispatched_video_id(placeholder_id):
+    """The Heygen id a queued placeholder row was renamed to, or None"""
+    prefix = queued_video_id('')
+    if not placeholder_id.startswith(prefix):
+        return None
     try:
-        print("Making test request to Heygen API...")
-        response = session.get(
-            'https://api.heygen.com/v2/avatars',
-            headers=headers,
-            timeout=30,  # increased timeout
-            verify=False
-        )
-        
-        print(f"Response Status Code: {response.status_code}")
-        print(f"Response Headers: {dict(response.headers)}")
-        print(f"Response Content: {response.text[:500]}...")
-        
-        if response.status_code == 200:
-            print("Successfully connected to Heygen API!")
-            return True
-        else:
-            print(f"Failed to connect to Heygen API. Status code: {response.status_code}")
-            return False
-            
-    except Exception as e:
-        print(f"Error testing API connection: {str(e)}")
-        return False
+        job = job_queue.get(int(placeholder_id[len(prefix):]))
+    except ValueError:
+        return None
+    return job['video_id'] if job else None
+
+def on_job_submitted(job, video_id, key_id=None):
+    placeholder_id = queued_video_id(job['id'])
+    # Later status calls for this video go through the same account
+    video_store.promote_queued_video(placeholder_id, video_id, api_key_id=key_id)
+    status_poller.track(video_id)
+    video_events.publish({'id': placeholder_id, 'video_id': video_id,
+                          'status': 'PROCESSING', 'video_url': ''})
+
+def on_job_failed(job, error):
+    placeholder_id = queued_video_id(job['id'])
+    video_store.mark_failed(placeholder_id, error)
+    video_events.publish({'id': placeholder_id, 'status': 'FAILED', 'video_url': ''})
+
+# Generation requests are persisted here and sent to Heygen by worker threads
+job_queue = JobQueue(
+    video_store,
+    heygen.generate_video,
+    on_submitted=on_job_submitted,
+    on_failed=on_job_failed,
+    workers=int(os.getenv('JOB_WORKERS', 2 * max(len(key_pool), 1))),
+    # Limits are per account, so throughput grows with the key pool
+    rate=float(os.getenv('HEYGEN_SUBMIT_RATE', 1)) * max(len(key_pool), 1),
+    burst=int(os.getenv('HEYGEN_SUBMIT_BURST', 5)) * max(len(key_pool), 1),
+    pause_on_rate_limit=len(key_pool) <= 1
+)
+
+# Throughput and time-to-complete report served by /api/reports/pipeline
+pipeline_analytics = PipelineAnalytics(
+    video_store,
+    days=int(os.getenv('ANALYTICS_DAYS', 7)),
+    interval=int(os.getenv('ANALYTICS_INTERVAL', 300)),
+    stall_after=int(os.getenv('VIDEO_STALL_AFTER', 1800))
+)
+
+# Bump whenever an init_schema below changes; existing databases then migrate once
+SCHEMA_VERSION = 5
+
+def migrate_schema():
+    return video_store.migrate(SCHEMA_VERSION, [
+        video_store.init_schema,
+        job_queue.init_schema,
+        video_batches.init_schema,
+        video_mirror.init_schema,
+        webhook_receiver.init_schema,
+    ])
+
+# Startup state reported by /healthz
+startup = {
+    'startup_ms': None,
+    'schema_version': None,
+    'catalog_warmup': 'pending',
+}
 
-app = Flask(__name__)
+def warm_up_catalogs():
+    """Load the catalogs from Heygen in the background so startup never waits on it"""
+    try:
+        data = avatar_cache.refresh()
+        voice_cache.refresh()
+        total_avatars = len(data.get('data', {}).get('avatars', []))
+        total_talking_photos = len(data.get('data', {}).get('talking_photos', []))
+        logger.info("Loaded %d avatars and %d talking photos from Heygen", total_avatars, total_talking_photos)
+        startup['catalog_warmup'] = 'ok'
+    except CatalogError as e:
+        logger.warning("Failed to load catalogs from Heygen: %s", e)
+        startup['catalog_warmup'] = f'failed: {str(e)}'
+
+# Metrics
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to build a response, by route',
+                            ['route', 'method'])
+REQUESTS = Counter('http_requests_total', 'Responses by route and status', ['route', 'method', 'status'])
+CATALOG_LOOKUPS = Counter('catalog_cache_lookups_total', 'Catalog cache lookups by result', ['cache', 'result'],
+                          fn=lambda: {(c.name, result): getattr(c, attr)
+                                      for c in (avatar_cache, voice_cache)
+                                      for result, attr in (('hit', 'hits'), ('stale', 'stale_hits'), ('miss', 'misses'))})
+CATALOG_HIT_RATIO = Gauge('catalog_cache_hit_ratio', 'Share of catalog lookups served from memory', ['cache'],
+                          fn=lambda: {(c.name,): c.stats()['hit_ratio'] or 0 for c in (avatar_cache, voice_cache)})
+MEDIA_LOOKUPS = Counter('media_cache_lookups_total', 'Thumbnail cache lookups by result', ['result'],
+                        fn=lambda: {('hit',): media_cache.hits, ('miss',): media_cache.misses})
+MEDIA_BYTES = Gauge('media_cache_size_bytes', 'Bytes stored in the thumbnail cache',
+                    fn=lambda: media_cache.stats()['size_bytes'])
+MIRROR_BYTES = Gauge('video_mirror_size_bytes', 'Bytes of mirrored videos on disk', fn=video_mirror.used_bytes)
+MIRROR_DOWNLOADS = Counter('video_mirror_downloads_total', 'Videos downloaded into the local mirror',
+                           fn=lambda: video_mirror.downloads)
+JOBS = Gauge('jobs', 'Generation jobs by status', ['status'],
+             fn=lambda: {(status,): count for status, count in job_queue.status_counts().items()})
+KEY_REQUESTS = Counter('heygen_key_requests_total', 'Heygen requests by API key id', ['key_id'],
+                       fn=lambda: {(key['id'],): key['requests'] for key in key_pool.stats()})
+KEY_RATE_LIMITED = Counter('heygen_key_rate_limited_total', 'Heygen 429 responses by API key id', ['key_id'],
+                           fn=lambda: {(key['id'],): key['rate_limited'] for key in key_pool.stats()})
+KEY_REMAINING = Gauge('heygen_key_remaining_quota', 'Remaining credits reported for each API key', ['key_id'],
+                      fn=lambda: {(key['id'],): key['remaining'] for key in key_pool.stats()
+                                  if key['remaining'] is not None})
+JOBS_RATE_LIMITED = Counter('jobs_rate_limited_total', 'Submissions answered with 429 by Heygen',
+                            fn=lambda: job_queue.rate_limited)
+POLLER_TRACKED = Gauge('status_poller_tracked_videos', 'In-flight videos being polled',
+                       fn=status_poller.tracked_count)
+FRAGMENT_LOOKUPS = Counter('fragment_cache_lookups_total', 'Rendered fragment lookups by result', ['result'],
+                           fn=lambda: {('hit',): fragment_cache.hits, ('miss',): fragment_cache.misses})
+RESPONSES_COMPRESSED = Counter('http_responses_compressed_total', 'Response bodies sent compressed',
+                               fn=lambda: compressor.compressed)
+CIRCUIT_OPEN = Gauge('heygen_circuit_open', '1 while requests to a Heygen endpoint fail fast', ['endpoint'],
+                     fn=lambda: {(endpoint,): int(state == 'open') for endpoint, state in heygen.circuit_states().items()})
+WEBHOOKS = Counter('heygen_webhooks_total', 'Heygen webhook deliveries by result', ['result'],
+                   fn=lambda: {(result,): count for result, count in webhook_receiver.stats().items()})
+EVENT_SUBSCRIBERS = Gauge('video_event_subscribers', 'Open /events/videos streams',
+                          fn=video_events.subscriber_count)
+
+# Adds a Server-Timing header splitting each response into app, db and heygen time
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', '0') == '1'
+
+bp = Blueprint('web', __name__)
+
+@bp.before_app_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+    start_timings()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = getattr(request, 'started_at', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.observe(elapsed, route=route, method=request.method)
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    timings = finish_timings()
+    if SERVER_TIMING_ENABLED:
+        timings['app'] = elapsed
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+    return response
+
+# Registered after record_request_metrics so it runs first and 304s are counted
+@bp.after_app_request
+def compress_response(response):
+    if COMPRESSION_ENABLED:
+        return compressor.process(request, response)
+    return response
+
+@bp.app_context_processor
+def inject_upstream_state():
+    # Every page shows the read-only banner while a Heygen circuit is open
+    return {'degraded': upstream_degraded()}
+
+# Endpoints the app cannot create or show videos without; status, quota and
+# voice calls failing on their own do not make the app read-only
+DEGRADING_ENDPOINTS = ('v2/video/generate', 'v1/video.list', 'v2/avatars')
+
+def upstream_degraded():
+    return any(endpoint in DEGRADING_ENDPOINTS for endpoint in heygen.open_circuits())
 
-@app.route('/')
+@bp.before_app_request
+def start_background_workers():
+    if os.getenv('STATUS_POLLER_ENABLED', '1') == '1' and not status_poller.running:
+        status_poller.start()
+    if os.getenv('VIDEO_SYNC_ENABLED', '1') == '1' and not video_sync.running:
+        video_sync.start()
+    if os.getenv('JOB_WORKERS_ENABLED', '1') == '1' and not job_queue.running:
+        job_queue.start()
+    if os.getenv('VIDEO_MIRROR_ENABLED', '1') == '1' and not video_mirror.running:
+        video_mirror.start()
+    if os.getenv('KEY_QUOTA_REFRESH_ENABLED', '1') == '1' and not key_pool.running:
+        key_pool.start()
+    if os.getenv('ANALYTICS_ENABLED', '1') == '1' and not pipeline_analytics.running:
+        pipeline_analytics.start()
+
+@bp.route('/')
 def home():
     return render_template('home.html')
 
-@app.route('/avatars')
+def avatar_query_args():
+    """Read the avatar index filters shared by the page and the JSON API"""
+    return {
+        'gender': request.args.get('gender') or None,
+        'type': request.args.get('type') or None,
+        'q': request.args.get('q', '').strip() or None,
+    }
+
+@bp.route('/avatars')
 def avatars():
     page = request.args.get('page', 1, type=int)
-    per_page = 30
-    max_retries = 3
-    retry_delay = 1  # seconds
+    photo_page = request.args.get('photo_page', 1, type=int)
+    filters = avatar_query_args()
     
-    for attempt in range(max_retries):
-        try:
-            headers = {
-                'x-api-key': HEYGEN_API_KEY,
-                'accept': 'application/json'
-            }
-            
-            print(f"\nFetching avatars from Heygen API (attempt {attempt + 1}/{max_retries})...")
-            response = session.get(
-                'https://api.heygen.com/v2/avatars',
-                headers=headers,
-                timeout=30,
-                verify=False
-            )
-            
-            print(f"Response Status Code: {response.status_code}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Get all avatars and talking photos
-                all_avatars = data.get('data', {}).get('avatars', [])
-                all_talking_photos = data.get('data', {}).get('talking_photos', [])
-                
-                # Calculate total counts
-                total_avatars = len(all_avatars)
-                total_talking_photos = len(all_talking_photos)
-                
-                # Calculate pagination
-                start_idx = (page - 1) * per_page
-                end_idx = start_idx + per_page
-                
-                # Get paginated avatars
-                paginated_avatars = all_avatars[start_idx:end_idx]
-                
-                # Calculate total pages
-                total_pages = (total_avatars + per_page - 1) // per_page
-                
-                print(f"\nFound {total_avatars} avatars and {total_talking_photos} talking photos")
-                print(f"Showing page {page} of {total_pages}")
-                
-                return render_template('avatars.html', 
-                                    avatars=paginated_avatars,
-                                    talking_photos=all_talking_photos,
-                                    current_page=page,
-                                    total_pages=total_pages,
-                                    total_avatars=total_avatars,
-                                    total_talking_photos=total_talking_photos,
-                                    error=None)
-            else:
-                error_msg = f"API request failed: {response.status_code} - {response.text}"
-                print(f"\nError: {error_msg}")
-                if attempt < max_retries - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # exponential backoff
-                    continue
-                return render_template('avatars.html', 
-                                    avatars=[], 
-                                    talking_photos=[],
-                                    error=error_msg)
-                
-        except Exception as e:
-            error_msg = f"Error fetching avatars (attempt {attempt + 1}/{max_retries}): {str(e)}"
-            print(f"\nException: {error_msg}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # exponential backoff
-                continue
-            return render_template('avatars.html', 
-                                avatars=[], 
-                                talking_photos=[],
-                                error=error_msg)
-
-@app.route('/submit', methods=['GET', 'POST'])
+    try:
+        index = avatar_cache.get_built()
+    except CatalogError as e:
+        error_msg = str(e)
+        logger.warning("Avatar catalog unavailable: %s", error_msg)
+        return render_template('avatars.html', 
+                            avatars=[], 
+                            talking_photos=[],
+                            error=error_msg)
+    
+    # Same catalog version, pages, filters and banner render the same grid
+    key = (page, photo_page, filters['gender'], filters['type'], filters['q'], upstream_degraded())
+    return fragment_cache.get_or_render('avatars', index.version, key,
+                                        lambda: render_avatars(index, page, photo_page, filters))
+
+def render_avatars(index, page, photo_page, filters):
+    avatar_page = index.query('avatars', page=page, **filters)
+    talking_photo_page = index.query('talking_photos', page=photo_page, q=filters['q'])
+    
+    return render_template('avatars.html', 
+                        avatars=avatar_page['items'],
+                        talking_photos=talking_photo_page['items'],
+                        current_page=avatar_page['page'],
+                        total_pages=avatar_page['total_pages'],
+                        photo_page=talking_photo_page['page'],
+                        total_photo_pages=talking_photo_page['total_pages'],
+                        total_avatars=len(index.avatars.items),
+                        total_talking_photos=len(index.talking_photos.items),
+                        matching_avatars=avatar_page['total'],
+                        genders=index.avatars.genders,
+                        types=index.avatars.types,
+                        filters=filters,
+                        error=None)
+
+@bp.route('/api/avatars')
+def api_avatars():
+    kind = request.args.get('kind', 'avatars')
+    if kind not in ('avatars', 'talking_photos'):
+        return jsonify({'error': 'kind must be avatars or talking_photos'}), 400
+    
+    try:
+        index = avatar_cache.get_built()
+    except CatalogError as e:
+        return jsonify({'error': str(e)}), 502
+    
+    result = index.query(kind,
+                         page=request.args.get('page', 1, type=int),
+                         per_page=request.args.get('per_page', DEFAULT_PER_PAGE, type=int),
+                         cursor=request.args.get('cursor') or None,
+                         **avatar_query_args())
+    return jsonify(result)
+
+@bp.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@bp.route('/avatar_cache_stats')
+def avatar_cache_stats():
+    return jsonify(avatar_cache.stats())
+
+READ_ONLY_MESSAGE = "Heygen is unavailable, so new videos cannot be created right now. Please try again shortly."
+
+def queue_video(payload, name, idempotency_key=None, batch_id=None):
+    """Queue a generation request and add its QUEUED placeholder to videos.db"""
+    with video_store.transaction():
+        job, created = job_queue.enqueue(payload, idempotency_key, batch_id)
+        if created:
+            video_store.insert_video(queued_video_id(job['id']), name, QUEUED_STATUS,
+                                     **payload_details(payload))
+    return job
+
+video_batches = VideoBatches(video_store, queue_video)
+
+def thumbnail_source_url(item_id):
+    """Upstream image URL for an avatar, talking photo or video id"""
+    try:
+        index = avatar_cache.get_built()
+        item = index.get_avatar(item_id) or index.get_talking_photo(item_id)
+        if item:
+            return item.get('preview_image_url')
+    except CatalogError:
+        pass
+    row = video_store.get(item_id)
+    return row['thumbnail_url'] if row else None
+
+@bp.route('/media/thumb/<item_id>')
+def media_thumb(item_id):
+    url = thumbnail_source_url(item_id)
+    if not url:
+        return redirect(url_for('static', filename='default-thumbnail.svg'))
+    
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    try:
+        path, mimetype, etag = media_cache.get(url, request.args.get('w', type=int), fmt)
+    except MediaError as e:
+        logger.warning("Error fetching thumbnail for %s: %s", item_id, e, extra={'item_id': item_id})
+        return redirect(url_for('static', filename='default-thumbnail.svg'))
+    
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=86400)
+    response.cache_control.public = True
+    response.vary.add('Accept')
+    return response
+
+@bp.route('/submit', methods=['GET', 'POST'])
 def submit():
     try:
-        headers = {
-            'x-api-key': HEYGEN_API_KEY,
-            'accept': 'application/json'
-        }
-        
-        response = session.get(
-            'https://api.heygen.com/v2/avatars',
-            headers=headers,
-            timeout=30,
-            verify=False
-        )
-        
-        if response.status_code != 200:
+        try:
+            avatars_data = avatar_cache.get()
+        except CatalogError:
             return render_template('submit.html', 
                                 error="Failed to fetch avatars",
-                                avatars=[])
+                                avatars=[],
+                                idempotency_key=new_idempotency_key())
         
-        avatars_data = response.json()
         avatars_list = avatars_data.get('data', {}).get('avatars', [])
         
         if request.method == 'POST':
+            if upstream_degraded():
+                return render_template('submit.html',
+                                    error=READ_ONLY_MESSAGE,
+                                    avatars=avatars_list,
+                                    idempotency_key=request.form.get('idempotency_key') or new_idempotency_key()), 503
+            
             avatar_id = request.form.get('avatar_id')
             input_text = request.form.get('input_text')
             voice_id = request.form.get('voice_id')
@@ -211,306 +463,301 @@ def submit():
             caption = request.form.get('caption') == 'on'
             
             width, height = map(int, dimension.split('x'))
+            payload = build_video_payload(avatar_id, input_text, voice_id, width, height, caption)
             
-            payload = {
-                "video_inputs": [
-                    {
-                        "character": {
-                            "type": "avatar",
-                            "avatar_id": avatar_id,
-                            "avatar_style": "normal"
-                        },
-                        "voice": {
-                            "type": "text",
-                            "input_text": input_text,
-                            "voice_id": voice_id
-                        }
-                    }
-                ],
-                "caption": caption,
-                "dimension": {
-                    "width": width,
-                    "height": height
-                }
-            }
-            
-            print(f"\nSending video generation request with payload: {json.dumps(payload, indent=2)}")
-            
-            response = session.post(
-                'https://api.heygen.com/v2/video/generate',
-                headers={
-                    'x-api-key': HEYGEN_API_KEY,
-                    'Content-Type': 'application/json'
-                },
-                json=payload,
-                timeout=30,
-                verify=False
-            )
-            
-            if response.status_code == 200:
-                video_data = response.json()
-                print(f"\nVideo creation response: {json.dumps(video_data, indent=2)}")
-                
-                # Get video ID from response
-                video_id = video_data.get('data', {}).get('video_id')
-                if not video_id:
-                    return render_template('submit.html',
-                                        error="Failed to get video ID from response",
-                                        avatars=avatars_list,
-                                        selected_avatar_id=avatar_id)
-                
-                # Store video information in database
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                now = datetime.now().isoformat()
-                
-                c.execute('''
-                    INSERT INTO videos (id, name, status, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (video_id, f"Video {now}", 'PROCESSING', now, now))
-                
-                conn.commit()
-                conn.close()
-                
-                return redirect(url_for('videos'))
-            else:
-                error_msg = f"Failed to create video: {response.status_code} - {response.text}"
-                print(f"\nError: {error_msg}")
-                return render_template('submit.html',
-                                    error=error_msg,
-                                    avatars=avatars_list,
-                                    selected_avatar_id=avatar_id)
+            # Sent to Heygen by the job queue workers; the form's key makes resubmits harmless
+            job = queue_video(payload, f"Video {datetime.now().isoformat()}",
+                              request.form.get('idempotency_key') or None)
+            logger.info("Queued video generation job %s", job['id'], extra={'job_id': job['id']})
+            return redirect(url_for('.videos'))
         
         selected_avatar_id = request.args.get('avatar')
         return render_template('submit.html',
                             avatars=avatars_list,
-                            selected_avatar_id=selected_avatar_id)
+                            selected_avatar_id=selected_avatar_id,
+                            idempotency_key=new_idempotency_key())
                             
     except Exception as e:
         error_msg = f"An error occurred: {str(e)}"
         return render_template('submit.html',
                             error=error_msg,
-                            avatars=[])
+                            avatars=[],
+                            idempotency_key=new_idempotency_key())
 
-@app.route('/videos')
-def videos():
+def create_batch(rows, name=None, idempotency_key=None):
+    """Validate rows against the cached catalogs and queue them as one batch"""
+    items = validate_rows(rows, avatar_cache.get_built(), voice_cache.get_built())
+    return video_batches.create(items, name, idempotency_key)
+
+@bp.route('/api/videos/batch', methods=['POST'])
+def api_create_batch():
+    if upstream_degraded():
+        return jsonify({'error': READ_ONLY_MESSAGE}), 503
     try:
-        # Get videos from Heygen API
-        headers = {
-            'x-api-key': HEYGEN_API_KEY,
-            'accept': 'application/json'
-        }
+        upload = request.files.get('file')
+        if upload:
+            rows = parse_batch_file(upload.filename, upload.read())
+            name = request.form.get('name') or upload.filename
+        else:
+            body = request.get_json(silent=True)
+            if body is None:
+                return jsonify({'error': 'Send a JSON body or a file upload'}), 400
+            rows = body.get('videos') if isinstance(body, dict) else body
+            name = body.get('name') if isinstance(body, dict) else None
         
-        print("Fetching video list from Heygen...")
-        # Get video list from Heygen
-        response = session.get(
-            'https://api.heygen.com/v1/video.list?limit=10',
-            headers=headers,
-            timeout=30,
-            verify=False
-        )
+        batch_id = create_batch(rows, name, request.headers.get('Idempotency-Key'))
         
-        print(f"Video list response: {response.text}")
+    except BatchError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+    except CatalogError as e:
+        return jsonify({'error': f"Could not validate against the Heygen catalog: {str(e)}"}), 502
+    
+    progress = video_batches.progress(batch_id)
+    progress['status_url'] = url_for('.api_batch_progress', batch_id=batch_id)
+    return jsonify(progress), 202, {'Location': progress['status_url']}
+
+@bp.route('/api/videos/batch/<batch_id>')
+def api_batch_progress(batch_id):
+    progress = video_batches.progress(batch_id)
+    if progress is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(progress)
+
+@bp.route('/submit/batch', methods=['POST'])
+def submit_batch():
+    """Bulk import form on the Create Video page"""
+    upload = request.files.get('file')
+    try:
+        if upstream_degraded():
+            raise BatchError(READ_ONLY_MESSAGE)
+        if not upload or not upload.filename:
+            raise BatchError("Choose a CSV or JSONL file to import")
+        rows = parse_batch_file(upload.filename, upload.read())
+        batch_id = create_batch(rows, upload.filename, request.form.get('idempotency_key') or None)
+        return redirect(url_for('.videos', batch=batch_id))
         
-        if response.status_code != 200:
-            return render_template('videos.html', error=f"Failed to fetch videos from Heygen: {response.text}", videos=[])
-            
-        videos_data = response.json()
-        videos = []
+    except (BatchError, CatalogError) as e:
+        try:
+            avatars_list = avatar_cache.get().get('data', {}).get('avatars', [])
+        except CatalogError:
+            avatars_list = []
+        return render_template('submit.html',
+                            error=f"Bulk import failed: {str(e)}",
+                            batch_errors=getattr(e, 'errors', []),
+                            avatars=avatars_list,
+                            idempotency_key=new_idempotency_key()), 400
+
+def video_card(row):
+    """Template fields for one videos.db row"""
+    created = parse_timestamp(row['created_at'])
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'status': (row['status'] or 'PROCESSING').upper(),
+        'thumbnail_url': row['thumbnail_url'],
+        'video_url': row['video_url'],
+        'created_at': created.strftime('%Y-%m-%d %H:%M:%S') if created else '',
+        'duration': row['duration'] or '',
+        'error': row['error'] or ''
+    }
+
+def render_video_card(card):
+    """Card HTML for one video; keyed on every field, so an updated row re-renders"""
+    key = tuple(card.values())
+    return Markup(fragment_cache.get_or_render('video_cards', 1, key,
+                                               lambda: render_template('_video_card.html', video=card)))
+
+@bp.route('/videos')
+def videos():
+    page = max(1, request.args.get('page', 1, type=int))
+    sort = request.args.get('sort', 'newest')
+    if sort not in VIDEO_SORTS:
+        sort = 'newest'
+    status = request.args.get('status', '').upper() or None
+    per_page = 30
+    
+    try:
+        # Rendered from videos.db; the background sync pulls new upstream videos
+        video_sync.request_sync()
         
-        # Process each video
-        for video in videos_data.get('data', {}).get('videos', []):
-            try:
-                video_id = video.get('video_id')
-                if not video_id:
-                    print(f"Skipping video with no ID: {video}")
-                    continue
-                    
-                print(f"\nProcessing video: {video_id}")
-                
-                # Format created_at properly
-                try:
-                    created_timestamp = video.get('created_at', '')
-                    if isinstance(created_timestamp, (int, float)):
-                        created_at = datetime.fromtimestamp(created_timestamp).isoformat()
-                    else:
-                        created_at = datetime.now().isoformat()
-                except Exception as e:
-                    print(f"Error formatting date: {e}")
-                    created_at = datetime.now().isoformat()
-                
-                status = video.get('status', 'PROCESSING').upper()
-                video_url = video.get('video_url', '')
-                thumbnail_url = video.get('thumbnail_url', '')
-                
-                print(f"Video details: status={status}, url={video_url}, created_at={created_at}")
-                
-                # Update database with latest info
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                
-                # Check if video exists in database
-                c.execute('SELECT * FROM videos WHERE id = ?', (video_id,))
-                existing_video = c.fetchone()
-                
-                if existing_video:
-                    # Update existing video
-                    c.execute('''
-                        UPDATE videos 
-                        SET status = ?, video_url = ?, thumbnail_url = ?, 
-                            updated_at = ?
-                        WHERE id = ?
-                    ''', (status, video_url, thumbnail_url, 
-                          datetime.now().isoformat(), video_id))
-                else:
-                    # Insert new video
-                    c.execute('''
-                        INSERT INTO videos (id, name, status, thumbnail_url, video_url, 
-                                         created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (video_id, f"Video {video_id}", status, thumbnail_url, 
-                          video_url, created_at, datetime.now().isoformat()))
-                
-                conn.commit()
-                
-                videos.append({
-                    'id': video_id,
-                    'name': f"Video {video_id}",
-                    'status': status,
-                    'thumbnail_url': thumbnail_url,
-                    'video_url': video_url,
-                    'created_at': datetime.fromisoformat(created_at).strftime('%Y-%m-%d %H:%M:%S'),
-                    'duration': video.get('duration', ''),
-                    'error': video.get('error', '')
-                })
-                
-                conn.close()
-                
-            except Exception as e:
-                print(f"Error processing video {video.get('video_id', 'unknown')}: {str(e)}")
-                continue
+        total_videos = video_store.count_videos(status)
+        total_pages = (total_videos + per_page - 1) // per_page
+        rows = video_store.list_videos(offset=(page - 1) * per_page, limit=per_page,
+                                       sort=sort, status=status)
         
-        if not videos:
-            print("No videos found in the response")
-            
-        return render_template('videos.html', videos=videos)
+        batch_id = request.args.get('batch')
+        
+        return render_template('videos.html',
+                            cards=[render_video_card(video_card(row)) for row in rows],
+                            batch=video_batches.progress(batch_id) if batch_id else None,
+                            current_page=page,
+                            total_pages=total_pages,
+                            total_videos=total_videos,
+                            status_counts=video_store.status_counts(),
+                            sort=sort,
+                            status=status,
+                            sync_error=video_sync.last_error)
         
     except Exception as e:
-        print(f"Error in videos route: {str(e)}")
-        return render_template('videos.html', error=str(e), videos=[])
+        logger.exception("Error in videos route")
+        return render_template('videos.html', error=str(e), cards=[])
+
+@bp.route('/api/videos/search')
+def api_search_videos():
+    """Full-text search over titles and scripts with status/date filters and keyset paging"""
+    q = request.args.get('q', '').strip() or None
+    status = request.args.get('status', '').upper() or None
+    sort = request.args.get('sort', 'newest')
+    if sort not in ('newest', 'oldest'):
+        return jsonify({'error': 'sort must be newest or oldest'}), 400
+    
+    created_from = request.args.get('from') or None
+    created_to = request.args.get('to') or None
+    for value in (created_from, created_to):
+        if value and parse_timestamp(value) is None:
+            return jsonify({'error': f'Invalid date: {value}'}), 400
+    
+    cursor = request.args.get('cursor')
+    after = decode_keyset(cursor) if cursor else None
+    if cursor and after is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    rows, has_more = video_store.search_videos(q, status, created_from, created_to,
+                                               newest_first=sort == 'newest',
+                                               limit=request.args.get('limit', 30, type=int),
+                                               after=after)
+    videos = []
+    for row in rows:
+        video = video_card(row)
+        if 'snippet' in row.keys():
+            video['snippet'] = row['snippet']
+        videos.append(video)
+    
+    result = {
+        'videos': videos,
+        'next_cursor': encode_keyset(rows[-1]) if has_more else None,
+    }
+    # Facets describe the whole result set, so they come with the first page only by default
+    if request.args.get('facets', '0' if cursor else '1') == '1':
+        result['facets'] = video_store.search_facets(q, created_from, created_to)
+    return jsonify(result)
 
-@app.route('/play_video/<video_id>')
+def send_mirrored_video(video_file):
+    """Stream a mirrored video with Range support, or hand it to nginx"""
+    if VIDEO_MIRROR_ACCEL_PREFIX:
+        response = Response(mimetype=video_file['content_type'] or 'video/mp4')
+        response.headers['X-Accel-Redirect'] = VIDEO_MIRROR_ACCEL_PREFIX.rstrip('/') + '/' + video_file['path']
+        return response
+    return send_file(video_mirror.path_for(video_file),
+                     mimetype=video_file['content_type'] or 'video/mp4',
+                     etag=video_file['sha256'], conditional=True, max_age=86400)
+
+@bp.route('/play_video/<video_id>')
 def play_video(video_id):
     try:
-        headers = {
-            'x-api-key': HEYGEN_API_KEY,
-            'accept': 'application/json'
-        }
+        video_file = video_mirror.local_file(video_id)
+        if video_file:
+            return send_mirrored_video(video_file)
         
-        print(f"\nFetching status for video: {video_id}")
-        # Get video status with video_id
-        response = session.get(
-            f'https://api.heygen.com/v1/video_status.get?video_id={video_id}',
-            headers=headers,
-            timeout=30,
-            verify=False
-        )
+        video_data = fetch_video_status(video_id)
+        video_url = video_data.get('video_url', '')
+        status = video_data.get('status', '').upper()
+        logger.debug("Fetched status %s for video %s", status, video_id, extra={'video_id': video_id})
         
-        print(f"Status response: {response.text}")
-        
-        if response.status_code == 200:
-            status_data = response.json()
-            video_data = status_data.get('data', {})
-            video_url = video_data.get('video_url', '')
-            status = video_data.get('status', '').upper()
-            
-            print(f"Video URL: {video_url}")
-            print(f"Status: {status}")
+        if video_url:
+            # Update the video URL and status in the database
+            video_store.update_status(video_id, status, video_url,
+                                      duration=video_data.get('duration'), error=status_error(video_data))
+            if status == 'COMPLETED':
+                # Served locally from the next play on
+                video_mirror.request(video_id)
             
-            if video_url:
-                # Update the video URL and status in the database
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute('''
-                    UPDATE videos 
-                    SET video_url = ?, status = ?, updated_at = ?
-                    WHERE id = ?
-                ''', (video_url, status, datetime.now().isoformat(), video_id))
-                conn.commit()
-                conn.close()
-                
-                return redirect(video_url)
-            else:
-                # If video is not ready, try getting it from the video list
-                list_response = session.get(
-                    'https://api.heygen.com/v1/video.list?limit=10',
-                    headers=headers,
-                    timeout=30,
-                    verify=False
-                )
-                
-                if list_response.status_code == 200:
-                    videos = list_response.json().get('data', {}).get('videos', [])
-                    for video in videos:
-                        if video.get('video_id') == video_id:
-                            video_url = video.get('video_url', '')
-                            if video_url:
-                                return redirect(video_url)
-                
-                return jsonify({'error': 'Video not ready yet'}), 404
-        else:
-            print(f"Error response from API: {response.text}")
-            return jsonify({'error': f'Failed to fetch video status: {response.text}'}), response.status_code
+            return redirect(video_url)
+        
+        # If video is not ready, try getting it from the video list
+        for video in heygen.list_videos(limit=10, key_id=video_store.api_key_id(video_id)).get('videos', []):
+            if video.get('video_id') == video_id and video.get('video_url'):
+                return redirect(video['video_url'])
+        
+        return jsonify({'error': 'Video not ready yet'}), 404
             
+    except CircuitOpenError as e:
+        # Read-only mode: fall back to the last URL videos.db has for it
+        row = video_store.get(video_id)
+        if row and row['video_url']:
+            return redirect(row['video_url'])
+        return jsonify({'error': str(e)}), 503
+    except HeygenError as e:
+        logger.warning("Error fetching video %s from Heygen: %s", video_id, e, extra={'video_id': video_id})
+        return jsonify({'error': f'Failed to fetch video status: {str(e)}'}), e.status_code or 502
     except Exception as e:
-        print(f"Error playing video: {str(e)}")
+        logger.exception("Error playing video %s", video_id, extra={'video_id': video_id})
         return jsonify({'error': str(e)}), 500
 
-@app.route('/check_video_status/<video_id>')
+def video_status_payload(row):
+    """Status JSON for a videos.db row; in-flight videos are handed to the poller"""
+    status = (row['status'] or 'PROCESSING').upper()
+    if status not in UNPOLLED_STATUSES:
+        status_poller.track(row['id'], parse_timestamp(row['created_at']))
+    return {
+        'status': status,
+        'video_url': row['video_url'] or ''
+    }
+
+@bp.route('/check_video_status/<video_id>')
 def check_video_status(video_id):
     try:
-        headers = {
-            'x-api-key': HEYGEN_API_KEY,
-            'accept': 'application/json'
-        }
+        # Answered from videos.db; the background poller keeps it current
+        row = video_store.get(video_id)
+        if not row:
+            # A queued card asking after its submission was sent
+            renamed = dispatched_video_id(video_id)
+            row = renamed and video_store.get(renamed)
+            if not row:
+                return jsonify({'error': 'Video not found'}), 404
+            return jsonify(dict(video_status_payload(row), video_id=renamed))
         
-        # Get video status with video_id
-        response = session.get(
-            f'https://api.heygen.com/v1/video_status.get?video_id={video_id}',
-            headers=headers,
-            timeout=30,
-            verify=False
-        )
-        
-        if response.status_code == 200:
-            status_data = response.json()
-            video_data = status_data.get('data', {})
-            video_url = video_data.get('video_url', '')
-            status = video_data.get('status', '').upper()
-            
-            # Update database if status changed
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('''
-                UPDATE videos 
-                SET video_url = ?, status = ?, updated_at = ?
-                WHERE id = ?
-            ''', (video_url, status, datetime.now().isoformat(), video_id))
-            conn.commit()
-            conn.close()
+        return jsonify(video_status_payload(row))
             
-            return jsonify({
-                'status': status,
-                'video_url': video_url
-            })
-        else:
-            return jsonify({'error': 'Failed to fetch video status'}), response.status_code
+    except Exception as e:
+        logger.exception("Error checking video status for %s", video_id, extra={'video_id': video_id})
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/check_video_status')
+def check_video_statuses():
+    """Batched status lookup for clients that cannot use /events/videos"""
+    ids = [i for i in request.args.get('ids', '').split(',') if i][:200]
+    if not ids:
+        return jsonify({'error': 'ids parameter is required'}), 400
+    
+    try:
+        rows = video_store.get_by_ids(ids)
+        videos = {video_id: video_status_payload(row) for video_id, row in rows.items()}
+        # Queued placeholders are renamed once dispatched; tell the card its new id
+        renamed = {video_id: dispatched_video_id(video_id) for video_id in ids if video_id not in rows}
+        renamed_rows = video_store.get_by_ids([new_id for new_id in renamed.values() if new_id])
+        for video_id, new_id in renamed.items():
+            if new_id in renamed_rows:
+                videos[video_id] = dict(video_status_payload(renamed_rows[new_id]), video_id=new_id)
+        return jsonify({'videos': videos})
             
     except Exception as e:
-        print(f"Error checking video status: {str(e)}")
+        logger.exception("Error checking video statuses")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/update_video_details/<video_id>', methods=['POST'])
+@bp.route('/events/videos')
+def video_event_stream():
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(
+        stream_with_context(video_events.stream(last_event_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@bp.route('/update_video_details/<video_id>', methods=['POST'])
 def update_video_details(video_id):
     try:
         title = request.form.get('title', '').strip()
@@ -518,33 +765,106 @@ def update_video_details(video_id):
             return jsonify({'error': 'Title cannot be empty'}), 400
             
         # Update video title in database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''
-            UPDATE videos 
-            SET name = ?, updated_at = ?
-            WHERE id = ?
-        ''', (title, datetime.now().isoformat(), video_id))
-        conn.commit()
-        conn.close()
+        video_store.update_name(video_id, title)
         
         return jsonify({'success': True, 'title': title})
         
     except Exception as e:
-        print(f"Error updating video details: {str(e)}")
+        logger.exception("Error updating video details for %s", video_id, extra={'video_id': video_id})
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/webhooks/heygen', methods=['POST'])
+def heygen_webhook():
+    try:
+        result = webhook_receiver.handle(request.get_data(), request.headers.get('Signature'))
+    except WebhookError as e:
+        logger.warning("Rejected Heygen webhook: %s", e)
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify(result)
+
+@bp.route('/api/reports/pipeline')
+def pipeline_report():
+    """Per-avatar, per-dimension and per-day throughput with p50/p95 time to complete"""
+    days = request.args.get('days', pipeline_analytics.days, type=int)
+    if not 1 <= days <= 366:
+        return jsonify({'error': 'days must be between 1 and 366'}), 400
+    try:
+        return jsonify(pipeline_analytics.report(days))
+    except Exception as e:
+        logger.exception("Error building pipeline report")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/healthz')
+def healthz():
+    """Readiness probe: the database must answer; Heygen state is reported, not required"""
+    checks = {}
+    ready = True
+    try:
+        video_store.execute('SELECT 1').fetchone()
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = f'error: {str(e)}'
+        ready = False
+    
+    catalog = avatar_cache.stats()
+    checks['avatar_catalog'] = 'cached' if catalog['cached'] else startup['catalog_warmup']
+    checks['workers'] = {
+        'status_poller': status_poller.running,
+        'video_sync': video_sync.running,
+        'job_queue': job_queue.running,
+        'video_mirror': video_mirror.running,
+        'pipeline_analytics': pipeline_analytics.running,
+    }
+    checks['heygen'] = heygen.circuit_states()
+    checks['api_keys'] = key_pool.stats()
+    
+    return jsonify({
+        'status': ('degraded' if upstream_degraded() else 'ok') if ready else 'unavailable',
+        'checks': checks,
+        'schema_version': startup['schema_version'],
+        'startup_ms': startup['startup_ms'],
+    }), 200 if ready else 503
+
+def create_app():
+    """Build the Flask app.
+
+    Services above are created once per process; this only sets up logging,
+    migrates the schema if needed, registers the routes and starts the
+    catalog warm-up without waiting for it.
+    """
+    started = time.perf_counter()
+    configure_logging(
+        level=os.getenv('LOG_LEVEL', 'INFO'),
+        fmt=os.getenv('LOG_FORMAT', 'json'),
+        secrets=[key.key for key in key_pool.keys],
+        sample_rate=float(os.getenv('LOG_SAMPLE_RATE', 0.01)),
+        max_length=int(os.getenv('LOG_MAX_FIELD_LENGTH', 1000))
+    )
+    migrated = migrate_schema()
+    startup['schema_version'] = video_store.schema_version()
+    
+    app = Flask(__name__)
+    if os.getenv('STATIC_MAX_AGE'):
+        # Without it browsers revalidate static/ with If-None-Match on every load
+        app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.getenv('STATIC_MAX_AGE'))
+    app.register_blueprint(bp)
+    
+    if os.getenv('CATALOG_WARMUP', '1') == '1' and startup['catalog_warmup'] == 'pending':
+        startup['catalog_warmup'] = 'running'
+        threading.Thread(target=warm_up_catalogs, name='catalog-warmup', daemon=True).start()
+    
+    startup['startup_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("App ready in %sms", startup['startup_ms'],
+                extra={'startup_ms': startup['startup_ms'], 'schema_version': startup['schema_version'],
+                       'migrated': migrated})
+    return app
+
 if __name__ == '__main__':
-    # Test API connection before starting the server
-    if not HEYGEN_API_KEY:
-        print("Error: HEYGEN_API_KEY not set in .env file")
+    # Development server; use gunicorn with gunicorn.conf.py in production
+    if not len(key_pool):
+        print("Error: HEYGEN_API_KEY or HEYGEN_API_KEYS not set in .env file")
         sys.exit(1)
-        
-    print("\nTesting API connection before starting server...")
-    if not test_api_connection():
-        print("\nFailed to connect to Heygen API. Please check your API key and internet connection.")
-        sys.exit(1)
-        
-    print("\nStarting Flask application...")
-    # Allow connections from any IP address
-    app.run(debug=True, host='0.0.0.0', port=5004)
+    
+    debug = os.getenv('FLASK_DEBUG', '0') == '1'
+    create_app().run(debug=debug, use_reloader=debug, threaded=True,
+                     host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', 5004)))
@@ -0,0 +1,177 @@
+"""In-process cache for Heygen catalog endpoints such as v2/avatars."""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogError(Exception):
+    """Raised when the catalog cannot be loaded and nothing is cached."""
+
+
+class CatalogCache:
+    """Caches one upstream catalog response for every route that needs it.
+
+    Fresh entries are served from memory. Once the TTL has passed the stale
+    entry keeps being served while a single background thread refreshes it;
+    entries older than ``max_stale`` are refreshed inline instead. Refreshes
+    send ``If-None-Match``/``If-Modified-Since`` when upstream gave us an
+    ETag or Last-Modified header, so an unchanged catalog costs a 304.
+
+    ``build(data, version)``, if given, is run once per changed payload and
+    its result is returned by ``get_built()``.
+    """
+
+    def __init__(self, fetch, ttl=300, max_stale=3600, name='catalog', build=None):
+        # fetch(extra_headers) -> requests.Response
+        self._fetch = fetch
+        self._build = build
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+
+        self._data = None
+        self._built = None
+        self._etag = None
+        self._last_modified = None
+        self._fetched_at = 0.0
+        self.version = 0
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    def get(self):
+        """Return the cached catalog payload, loading it if needed."""
+        return self._get_entry()[0]
+
+    def get_built(self):
+        """Return the ``build`` result for the cached payload."""
+        return self._get_entry()[1]
+
+    def refresh(self):
+        """Force a synchronous revalidation and return the payload."""
+        with self._load_lock:
+            self._refresh()
+        with self._lock:
+            return self._data
+
+    def _get_entry(self):
+        with self._lock:
+            entry = (self._data, self._built)
+            age = time.monotonic() - self._fetched_at
+            if entry[0] is not None and age < self.ttl:
+                self.hits += 1
+                return entry
+            if entry[0] is not None and age < self.max_stale:
+                self.stale_hits += 1
+                self._start_background_refresh()
+                return entry
+            self.misses += 1
+
+        # Cold or too stale: load inline, but let concurrent callers share
+        # a single upstream request.
+        with self._load_lock:
+            with self._lock:
+                if self._data is not None and time.monotonic() - self._fetched_at < self.ttl:
+                    return self._data, self._built
+            try:
+                self._refresh()
+            except CatalogError:
+                if self._data is None:
+                    raise
+            with self._lock:
+                return self._data, self._built
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'name': self.name,
+                'version': self.version,
+                'cached': self._data is not None,
+                'age_seconds': round(time.monotonic() - self._fetched_at, 1) if self._data is not None else None,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+                'refreshes': self.refreshes,
+                'not_modified': self.not_modified,
+                'errors': self.errors,
+            }
+
+    def _start_background_refresh(self):
+        # Caller holds self._lock
+        if self._refreshing:
+            return
+        self._refreshing = True
+        thread = threading.Thread(target=self._background_refresh,
+                                  name=f'{self.name}-refresh', daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            with self._load_lock:
+                self._refresh()
+        except CatalogError as e:
+            logger.warning("Background refresh of %s failed: %s", self.name, e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh(self):
+        # Caller holds self._load_lock
+        extra_headers = {}
+        with self._lock:
+            if self._data is not None:
+                if self._etag:
+                    extra_headers['If-None-Match'] = self._etag
+                if self._last_modified:
+                    extra_headers['If-Modified-Since'] = self._last_modified
+
+        try:
+            response = self._fetch(extra_headers)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            raise CatalogError(f"Error fetching {self.name}: {str(e)}") from e
+
+        with self._lock:
+            self.refreshes += 1
+            if response.status_code == 304 and self._data is not None:
+                self.not_modified += 1
+                self._fetched_at = time.monotonic()
+                return
+            if response.status_code != 200:
+                self.errors += 1
+                raise CatalogError(f"API request failed: {response.status_code} - {response.text[:500]}")
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            with self._lock:
+                self.errors += 1
+            raise CatalogError(f"Invalid {self.name} response: {str(e)}") from e
+        version = self.version + 1
+        # Built outside the state lock so readers keep getting the old entry
+        built = self._build(data, version) if self._build else None
+        with self._lock:
+            self._data = data
+            self._built = built
+            self._etag = response.headers.get('ETag')
+            self._last_modified = response.headers.get('Last-Modified')
+            self._fetched_at = time.monotonic()
+            self.version = version
@@ -0,0 +1,150 @@
+"""Precomputed, paginated view over the Heygen avatar catalog."""
+import base64
+import bisect
+import re
+
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(str(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the catalog position stored in a cursor, or None if invalid."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class _Collection:
+    """One list of catalog entries with its filter and prefix-search tables."""
+
+    def __init__(self, items, id_key, name_key):
+        self.items = items
+        self.id_key = id_key
+        self.name_key = name_key
+
+        # Catalog positions grouped by filter value, in catalog order
+        self._by_gender = {}
+        self._by_type = {}
+        # Sorted (token, position) pairs for prefix search on names
+        self._tokens = []
+        for pos, item in enumerate(items):
+            gender = (item.get('gender') or '').lower()
+            kind = (item.get('type') or '').lower()
+            self._by_gender.setdefault(gender, []).append(pos)
+            self._by_type.setdefault(kind, []).append(pos)
+            for token in set(_tokens(item.get(name_key))):
+                self._tokens.append((token, pos))
+        self._tokens.sort()
+        self._token_keys = [token for token, _ in self._tokens]
+        self._all = list(range(len(items)))
+
+        self.genders = sorted(g for g in self._by_gender if g)
+        self.types = sorted(t for t in self._by_type if t)
+
+    def _prefix_positions(self, prefix):
+        start = bisect.bisect_left(self._token_keys, prefix)
+        end = bisect.bisect_left(self._token_keys, prefix + '\uffff')
+        return {pos for _, pos in self._tokens[start:end]}
+
+    def positions(self, gender=None, kind=None, q=None):
+        """Return catalog positions matching every filter, in catalog order."""
+        candidates = None
+        if gender:
+            candidates = self._by_gender.get(gender.lower(), [])
+        if kind:
+            by_type = self._by_type.get(kind.lower(), [])
+            if candidates is None:
+                candidates = by_type
+            else:
+                allowed = set(by_type)
+                candidates = [pos for pos in candidates if pos in allowed]
+        if candidates is None:
+            candidates = self._all
+
+        terms = _tokens(q)
+        if terms:
+            matches = None
+            for term in terms:
+                found = self._prefix_positions(term)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    return []
+            if len(matches) < len(candidates):
+                allowed = set(candidates)
+                return sorted(pos for pos in matches if pos in allowed)
+            candidates = [pos for pos in candidates if pos in matches]
+        return candidates
+
+
+class AvatarIndex:
+    """Avatar and talking-photo lookups built once per catalog refresh.
+
+    Built from the raw ``v2/avatars`` payload, so a page render only costs
+    the size of the page rather than the size of the catalog.
+    """
+
+    def __init__(self, catalog, version=0):
+        data = (catalog or {}).get('data', {}) or {}
+        self.version = version
+        self.avatars = _Collection(data.get('avatars', []) or [],
+                                   'avatar_id', 'avatar_name')
+        self.talking_photos = _Collection(data.get('talking_photos', []) or [],
+                                          'talking_photo_id', 'talking_photo_name')
+        self._avatar_ids = {a.get('avatar_id'): a for a in self.avatars.items}
+        self._photo_ids = {p.get('talking_photo_id'): p for p in self.talking_photos.items}
+
+    def collection(self, kind):
+        if kind == 'talking_photos':
+            return self.talking_photos
+        return self.avatars
+
+    def get_avatar(self, avatar_id):
+        return self._avatar_ids.get(avatar_id)
+
+    def get_talking_photo(self, photo_id):
+        return self._photo_ids.get(photo_id)
+
+    def query(self, kind='avatars', page=1, per_page=DEFAULT_PER_PAGE,
+              cursor=None, gender=None, type=None, q=None):
+        """Return one page of ``kind`` matching the filters.
+
+        Pages can be addressed by number or by an opaque ``cursor`` taken from
+        a previous result's ``next_cursor``; the cursor wins when both are set.
+        """
+        collection = self.collection(kind)
+        per_page = max(1, min(per_page or DEFAULT_PER_PAGE, MAX_PER_PAGE))
+        positions = collection.positions(gender=gender, kind=type, q=q)
+        total = len(positions)
+        total_pages = (total + per_page - 1) // per_page
+
+        if cursor:
+            after = decode_cursor(cursor)
+            start_idx = bisect.bisect_right(positions, after) if after is not None else 0
+            page = start_idx // per_page + 1
+        else:
+            page = max(1, page or 1)
+            start_idx = (page - 1) * per_page
+        page_positions = positions[start_idx:start_idx + per_page]
+
+        has_more = start_idx + per_page < total
+        return {
+            'items': [collection.items[pos] for pos in page_positions],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_pages': total_pages,
+            'next_cursor': encode_cursor(page_positions[-1]) if has_more and page_positions else None,
+            'catalog_version': self.version,
+        }
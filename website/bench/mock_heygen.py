@@ -0,0 +1,215 @@
+"""Local stand-in for the Heygen endpoints the app calls, for benchmarks.
+
+Run it on its own and point the app at it with HEYGEN_API_BASE:
+
+    python bench/mock_heygen.py --port 8099 --latency 0.2
+    HEYGEN_API_BASE=http://127.0.0.1:8099 python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ENDPOINTS = ('v2/avatars', 'v2/voices', 'v1/video.list', 'v1/video_status.get', 'v2/video/generate',
+             'v2/user/remaining_quota')
+
+
+class MockHeygen:
+    """Serves generated catalogs and videos with configurable latency and errors.
+
+    ``error_rate`` is the share of requests answered with a 503;
+    ``rate_limit_rate`` the share answered with a 429 and ``Retry-After: 1``.
+    Videos created through ``v2/video/generate`` report PROCESSING for
+    ``complete_after`` seconds and COMPLETED afterwards.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 avatars=200, talking_photos=50, voices=50, videos=500, complete_after=5.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.complete_after = complete_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.avatars = [{
+            'avatar_id': f'avatar_{i:05d}',
+            'avatar_name': f'Avatar {i}',
+            'gender': ('female', 'male')[i % 2],
+            'preview_image_url': f'https://example.invalid/avatars/{i}.png',
+            'premium': i % 7 == 0,
+        } for i in range(avatars)]
+        self.talking_photos = [{
+            'talking_photo_id': f'photo_{i:05d}',
+            'talking_photo_name': f'Photo {i}',
+            'preview_image_url': f'https://example.invalid/photos/{i}.png',
+        } for i in range(talking_photos)]
+        self.voices = [{'voice_id': f'voice_{i:04d}', 'name': f'Voice {i}', 'language': 'English'}
+                       for i in range(voices)]
+
+        now = time.time()
+        # Newest first, like video.list
+        self.videos = [{
+            'video_id': f'video_{i:06d}',
+            'status': 'completed',
+            'created_at': int(now - i * 60),
+            'video_url': f'https://example.invalid/videos/{i}.mp4',
+            'thumbnail_url': f'https://example.invalid/thumbs/{i}.jpg',
+        } for i in range(videos)]
+        self._video_index = {video['video_id']: video for video in self.videos}
+        self._generated = {}
+        self.catalog_etag = f'"{uuid.uuid4().hex}"'
+
+        self.calls = {}
+
+    # Server lifecycle
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving in a background thread; returns the base URL."""
+        handler = type('Handler', (_Handler,), {'mock': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-heygen', daemon=True)
+        self._thread.start()
+        return f'http://{host}:{self._server.server_address[1]}'
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+
+    # Request handling
+
+    def handle(self, method, endpoint, query, body, headers):
+        """Return ``(status, json_body, extra_headers)`` for one request."""
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if endpoint not in ENDPOINTS:
+            return 404, {'error': f'Unknown endpoint {endpoint}'}, {}
+        if roll < self.error_rate:
+            return 503, {'error': 'Service unavailable'}, {}
+        if roll < self.error_rate + self.rate_limit_rate:
+            return 429, {'error': 'Too many requests'}, {'Retry-After': '1'}
+
+        if endpoint == 'v2/avatars':
+            if headers.get('If-None-Match') == self.catalog_etag:
+                return 304, None, {'ETag': self.catalog_etag}
+            return 200, {'data': {'avatars': self.avatars, 'talking_photos': self.talking_photos}}, \
+                {'ETag': self.catalog_etag}
+        if endpoint == 'v2/user/remaining_quota':
+            return 200, {'data': {'remaining_quota': 3600}}, {}
+        if endpoint == 'v2/voices':
+            return 200, {'data': {'voices': self.voices}}, {}
+        if endpoint == 'v1/video.list':
+            limit = int(query.get('limit', 100))
+            offset = int(query.get('token') or 0)
+            page = self.videos[offset:offset + limit]
+            token = str(offset + limit) if offset + limit < len(self.videos) else None
+            return 200, {'data': {'videos': page, 'token': token}}, {}
+        if endpoint == 'v1/video_status.get':
+            return self._video_status(query.get('video_id'))
+        if endpoint == 'v2/video/generate':
+            if method != 'POST' or not (body or {}).get('video_inputs'):
+                return 400, {'error': 'video_inputs is required'}, {}
+            video_id = uuid.uuid4().hex
+            with self._lock:
+                self._generated[video_id] = time.time()
+            return 200, {'data': {'video_id': video_id}}, {}
+
+    def _video_status(self, video_id):
+        video = self._video_index.get(video_id)
+        if video:
+            return 200, {'data': {'status': video['status'], 'video_url': video['video_url'],
+                                  'thumbnail_url': video['thumbnail_url']}}, {}
+        with self._lock:
+            created = self._generated.get(video_id)
+        if created is None:
+            return 404, {'error': 'Video not found'}, {}
+        if time.time() - created < self.complete_after:
+            return 200, {'data': {'status': 'processing', 'video_url': None}}, {}
+        return 200, {'data': {'status': 'completed',
+                              'video_url': f'https://example.invalid/videos/{video_id}.mp4',
+                              'thumbnail_url': f'https://example.invalid/thumbs/{video_id}.jpg'}}, {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                body = None
+
+        status, data, headers = self.mock.handle(method, url.path.strip('/'), query, body, self.headers)
+        payload = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock Heygen API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--avatars', type=int, default=200)
+    parser.add_argument('--talking-photos', type=int, default=50)
+    parser.add_argument('--videos', type=int, default=500)
+    args = parser.parse_args()
+
+    mock = MockHeygen(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, avatars=args.avatars,
+                      talking_photos=args.talking_photos, videos=args.videos)
+    print(f"Mock Heygen API listening on {mock.start(args.host, args.port)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
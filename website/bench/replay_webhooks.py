@@ -0,0 +1,75 @@
+"""Send signed sample Heygen webhook events to a running app.
+
+    python bench/replay_webhooks.py --secret $HEYGEN_WEBHOOK_SECRET --video-id abc123
+    python bench/replay_webhooks.py --secret s3cret --video-id abc123 --event fail --repeat 3
+    python bench/replay_webhooks.py --secret s3cret --file events.jsonl
+
+``--file`` replays one JSON event per line exactly as given. Every
+delivery is printed with the app's answer; sending an event twice should
+report ``duplicate`` the second time, and ``--bad-signature`` should be
+answered with 401.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from webhooks import sign
+
+
+def sample_event(event, video_id):
+    """A payload shaped like Heygen's avatar_video callbacks."""
+    if event == 'success':
+        return {'event_type': 'avatar_video.success', 'event_data': {
+            'video_id': video_id,
+            'url': f'https://files.example.invalid/videos/{video_id}.mp4',
+            'gif_download_url': f'https://files.example.invalid/videos/{video_id}.gif',
+            'callback_id': None,
+        }}
+    return {'event_type': 'avatar_video.fail', 'event_data': {
+        'video_id': video_id,
+        'msg': 'Sample failure replayed from bench/replay_webhooks.py',
+        'callback_id': None,
+    }}
+
+
+def deliver(url, secret, event, bad_signature=False):
+    body = json.dumps(event).encode()
+    signature = sign(secret, body)
+    if bad_signature:
+        signature = signature[::-1]
+    response = requests.post(url, data=body, timeout=10,
+                             headers={'Content-Type': 'application/json', 'Signature': signature})
+    return response.status_code, response.text.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay signed Heygen webhook events')
+    parser.add_argument('--url', default='http://127.0.0.1:5004/webhooks/heygen')
+    parser.add_argument('--secret', required=True, help='HEYGEN_WEBHOOK_SECRET of the app')
+    parser.add_argument('--video-id', action='append', default=[], help='Send a sample event for this video')
+    parser.add_argument('--event', choices=('success', 'fail'), default='success')
+    parser.add_argument('--file', help='JSONL file of events to send as-is')
+    parser.add_argument('--repeat', type=int, default=1, help='Deliver every event this many times')
+    parser.add_argument('--bad-signature', action='store_true', help='Sign with a wrong signature')
+    args = parser.parse_args()
+
+    events = [sample_event(args.event, video_id) for video_id in args.video_id]
+    if args.file:
+        with open(args.file) as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    if not events:
+        parser.error('give --video-id or --file')
+
+    for event in events:
+        for _ in range(args.repeat):
+            status, text = deliver(args.url, args.secret, event, args.bad_signature)
+            print(f"{event.get('event_type')} {event.get('event_data', {}).get('video_id')}: {status} {text}")
+
+
+if __name__ == '__main__':
+    main()
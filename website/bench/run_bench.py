@@ -0,0 +1,296 @@
+"""Load-test the hot routes against a mock Heygen API and compare with a baseline.
+
+    python bench/run_bench.py                      # run and compare with bench/baseline.json
+    python bench/run_bench.py --update-baseline    # record a new baseline
+    python bench/run_bench.py --scenario avatars --requests 2000 --concurrency 32
+
+The app is imported in-process with a throwaway videos.db and media
+directories, served by a threaded werkzeug server, and pointed at
+``MockHeygen`` through HEYGEN_API_BASE. Background workers are disabled so
+the upstream calls counted per route are the ones made on the request path.
+Exits with status 1 when a scenario regresses past the tolerances.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from metrics import percentile
+from mock_heygen import MockHeygen
+
+DEFAULT_BASELINE = BENCH_DIR / 'baseline.json'
+
+# A p99 has to grow by this much in absolute terms as well before it counts,
+# so sub-millisecond noise on fast routes does not fail the run
+P99_FLOOR_MS = 5.0
+
+
+class Scenarios:
+    """One method per benchmarked route; each returns ``(method, path, form)``."""
+
+    def __init__(self, mock, video_ids):
+        self.mock = mock
+        self.video_ids = video_ids
+        self.avatar_pages = max(1, len(mock.avatars) // 30)
+        self.video_pages = max(1, len(video_ids) // 20)
+
+    def avatars(self, rnd):
+        if rnd.random() < 0.2:
+            return 'GET', f'/avatars?q=avatar+{rnd.randint(0, 99)}', None
+        return 'GET', f'/avatars?page={rnd.randint(1, self.avatar_pages)}', None
+
+    def submit(self, rnd):
+        return 'POST', '/submit', {
+            'avatar_id': rnd.choice(self.mock.avatars)['avatar_id'],
+            'voice_id': rnd.choice(self.mock.voices)['voice_id'],
+            'input_text': 'Benchmark script ' + uuid.uuid4().hex,
+            'dimension': '1280x720',
+            'idempotency_key': uuid.uuid4().hex,
+        }
+
+    def videos(self, rnd):
+        return 'GET', f'/videos?page={rnd.randint(1, self.video_pages)}', None
+
+    def check_video_status(self, rnd):
+        return 'GET', f'/check_video_status/{rnd.choice(self.video_ids)}', None
+
+    def check_video_status_batch(self, rnd):
+        ids = ','.join(rnd.sample(self.video_ids, min(50, len(self.video_ids))))
+        return 'GET', f'/check_video_status?ids={ids}', None
+
+
+SCENARIOS = ('avatars', 'submit', 'videos', 'check_video_status', 'check_video_status_batch')
+
+# Time to import the app and build it, as a new worker process would
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import app
+app.create_app()
+print(json.dumps({'ms': (time.perf_counter() - started) * 1000}))
+'''
+
+
+def app_env(mock_url, workdir):
+    return {
+        'HEYGEN_API_KEY': 'bench-key',
+        'HEYGEN_API_BASE': mock_url,
+        'VIDEOS_DB_PATH': str(workdir / 'videos.db'),
+        'MEDIA_CACHE_DIR': str(workdir / 'media_cache'),
+        'VIDEO_MIRROR_DIR': str(workdir / 'video_mirror'),
+        'STATUS_POLLER_ENABLED': '0',
+        'VIDEO_SYNC_ENABLED': '0',
+        'JOB_WORKERS_ENABLED': '0',
+        'VIDEO_MIRROR_ENABLED': '0',
+        'KEY_QUOTA_REFRESH_ENABLED': '0',
+        'ANALYTICS_ENABLED': '0',
+    }
+
+
+def measure_startup(mock_url, workdir, runs=5):
+    """Median milliseconds to import and build the app in a fresh process.
+
+    ``cold_start_ms`` uses a new database, so it includes the schema
+    migration; ``warm_start_ms`` reuses it, like a worker added when scaling out.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, **app_env(mock_url, workdir), CATALOG_WARMUP='0')
+
+    def run():
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=str(BENCH_DIR.parent), env=env,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])['ms']
+
+    cold = []
+    for _ in range(runs):
+        for suffix in ('', '-wal', '-shm'):
+            Path(f"{env['VIDEOS_DB_PATH']}{suffix}").unlink(missing_ok=True)
+        cold.append(run())
+    warm = [run() for _ in range(runs)]
+    return {
+        'cold_start_ms': round(percentile(cold, 50), 1),
+        'warm_start_ms': round(percentile(warm, 50), 1),
+    }
+
+
+def start_app(mock_url, workdir):
+    """Import the app against the mock and serve it; returns ``(module, base_url, server)``."""
+    os.environ.update(app_env(mock_url, workdir))
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    # Access logs would dominate the output and the timings
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app_module.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return app_module, f'http://127.0.0.1:{server.server_port}', server
+
+
+def run_scenario(name, base_url, scenarios, mock, requests_count, concurrency, warmup, seed):
+    """Fire ``requests_count`` requests at one route; returns its result dict."""
+    make_request = getattr(scenarios, name)
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, path, form = make_request(random.Random(seed * 1000003 + i))
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base_url + path, data=form, allow_redirects=False, timeout=60)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(-warmup, 0)))
+        mock.reset()
+        started = time.perf_counter()
+        samples = list(pool.map(one, range(requests_count)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in samples]
+    errors = sum(1 for _, ok in samples if not ok)
+    upstream = mock.stats()
+    upstream_total = sum(upstream.values())
+    return {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'throughput_rps': round(requests_count / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'error_rate': round(errors / requests_count, 4),
+        'upstream_calls': upstream,
+        'upstream_calls_per_request': round(upstream_total / requests_count, 4),
+    }
+
+
+def compare(results, startup, baseline, tolerance):
+    """Return a list of regression messages."""
+    problems = []
+    for key, value in startup.items():
+        base = baseline.get('startup', {}).get(key)
+        if base and value > base * (1 + tolerance) and value - base > P99_FLOOR_MS:
+            problems.append(f"{key}: {value}ms vs baseline {base}ms")
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance) and result['p99_ms'] - base['p99_ms'] > P99_FLOOR_MS:
+            problems.append(f"{name}: p99 {result['p99_ms']}ms vs baseline {base['p99_ms']}ms")
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            problems.append(f"{name}: throughput {result['throughput_rps']} req/s vs baseline "
+                            f"{base['throughput_rps']} req/s")
+        if result['upstream_calls_per_request'] > base['upstream_calls_per_request'] + 0.01:
+            problems.append(f"{name}: {result['upstream_calls_per_request']} upstream calls per request vs "
+                            f"baseline {base['upstream_calls_per_request']}")
+        if result['error_rate'] > base['error_rate'] + 0.01:
+            problems.append(f"{name}: error rate {result['error_rate']} vs baseline {base['error_rate']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes against a mock Heygen API')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Route to benchmark; repeat for several (default: all)')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests per scenario')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mock Heygen latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of mock responses that are 503s')
+    parser.add_argument('--avatars', type=int, default=1000)
+    parser.add_argument('--talking-photos', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--update-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed relative change in p99 and throughput before failing (default: 0.5)')
+    args = parser.parse_args()
+
+    mock = MockHeygen(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      avatars=args.avatars, talking_photos=args.talking_photos, videos=args.videos,
+                      seed=args.seed)
+    mock_url = mock.start()
+
+    with tempfile.TemporaryDirectory(prefix='heygen-bench-') as workdir:
+        print("Measuring startup...")
+        startup = measure_startup(mock_url, Path(workdir) / 'startup')
+        print(f"  cold start {startup['cold_start_ms']}ms  warm start {startup['warm_start_ms']}ms")
+
+        app_module, base_url, server = start_app(mock_url, Path(workdir))
+        # Populate videos.db the way the background sync would
+        app_module.video_sync.sync(full=True)
+        video_ids = [row['id'] for row in app_module.video_store.list_videos(0, args.videos)]
+        scenarios = Scenarios(mock, video_ids)
+
+        results = {}
+        for name in args.scenario or SCENARIOS:
+            print(f"Running {name}...")
+            results[name] = run_scenario(name, base_url, scenarios, mock, args.requests,
+                                         args.concurrency, args.warmup, args.seed)
+            r = results[name]
+            print(f"  {r['throughput_rps']} req/s  p50 {r['p50_ms']}ms  p99 {r['p99_ms']}ms  "
+                  f"errors {r['error_rate']:.2%}  upstream/request {r['upstream_calls_per_request']}")
+
+        server.shutdown()
+    mock.stop()
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: getattr(args, key) for key in
+                     ('requests', 'concurrency', 'warmup', 'latency', 'jitter', 'error_rate',
+                      'avatars', 'talking_photos', 'videos', 'seed')},
+        'startup': startup,
+        'scenarios': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2) + '\n')
+        print(f"Saved baseline to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --update-baseline to record one")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get('settings') != report['settings']:
+        print("Warning: settings differ from the baseline; comparisons may not be meaningful")
+    problems = compare(results, startup, baseline, args.tolerance)
+    if problems:
+        print("\nREGRESSIONS:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""Production server settings, overridable through environment variables."""
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 5004)}"
+
+# The status poller, job workers, caches and the /events/videos broker live
+# in the process, so one worker is the default; scale with threads. More
+# workers each poll and dispatch independently and only see their own
+# events.
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+# Each open /events/videos stream holds a thread for its lifetime
+threads = int(os.getenv('WEB_THREADS', 32))
+
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = 10
+keepalive = 5
+
+# Import the app in each worker, after the fork, so background threads and
+# SQLite connections are never shared across processes
+preload_app = False
+
+accesslog = os.getenv('ACCESS_LOG', '-')
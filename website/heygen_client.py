@@ -0,0 +1,378 @@
+"""Client for the Heygen REST API shared by every route and background worker."""
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.retry import Retry
+
+from key_pool import KeyPool
+from metrics import Counter, Histogram, record_timing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.heygen.com'
+
+# (connect, read) timeouts per endpoint; anything else uses DEFAULT_TIMEOUT
+ENDPOINT_TIMEOUTS = {
+    'v2/avatars': (3.05, 20),
+    'v2/voices': (3.05, 20),
+    'v1/video.list': (3.05, 15),
+    'v1/video_status.get': (3.05, 10),
+    'v2/video/generate': (3.05, 30),
+    'v2/user/remaining_quota': (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+
+UPSTREAM_LATENCY = Histogram('heygen_request_duration_seconds',
+                             'Time spent on Heygen requests, including urllib3 retries', ['endpoint'])
+UPSTREAM_REQUESTS = Counter('heygen_requests_total',
+                            'Heygen requests by final HTTP status (error for transport failures)',
+                            ['endpoint', 'method', 'status'])
+UPSTREAM_RETRIES = Counter('heygen_retries_total', 'Requests retried by the urllib3 retry policy', ['endpoint'])
+UPSTREAM_COALESCED = Counter('heygen_coalesced_total', 'GETs answered by an identical request already in flight',
+                             ['endpoint'])
+UPSTREAM_REJECTED = Counter('heygen_queue_rejected_total', 'Requests dropped because no concurrency slot freed up',
+                            ['endpoint'])
+UPSTREAM_SHORT_CIRCUITED = Counter('heygen_short_circuited_total', 'Requests failed fast by an open circuit breaker',
+                                   ['endpoint'])
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+class HeygenError(Exception):
+    """Raised when a Heygen request fails or cannot be sent.
+
+    ``unsent`` is True when the request certainly never reached Heygen, so
+    even a POST can safely be sent again.
+    """
+
+    def __init__(self, message, status_code=None, response=None, unsent=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+        self.unsent = unsent
+
+
+class CircuitOpenError(HeygenError):
+    """Raised without contacting Heygen while an endpoint's circuit is open."""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Heygen {endpoint} is unavailable; retrying in {retry_after:.0f}s", 503, unsent=True)
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails fast after ``failure_threshold`` consecutive failures.
+
+    Once open, requests are refused for ``reset_timeout`` seconds. After
+    that a single probe is let through (half-open): success closes the
+    circuit, failure opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state; an open circuit past ``reset_timeout`` reports half-open.
+
+        Nothing has to call ``allow()`` for the timeout to count, so callers
+        that check the state before sending (the read-only mode) let the
+        next request through as the probe.
+        """
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = CIRCUIT_HALF_OPEN
+        return self._state
+
+    def allow(self):
+        """True if a request may be sent now."""
+        with self._lock:
+            state = self._current_state()
+            if state == CIRCUIT_CLOSED:
+                return True
+            if state == CIRCUIT_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CIRCUIT_CLOSED:
+                logger.info("Circuit for Heygen %s closed", self.name, extra={'endpoint': self.name})
+            self._state = CIRCUIT_CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self._current_state() == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != CIRCUIT_OPEN:
+                    self.opens += 1
+                    logger.warning("Circuit for Heygen %s opened after %d failures; failing fast for %.0fs",
+                                   self.name, self.failures, self.reset_timeout, extra={'endpoint': self.name})
+                self._state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a probe that neither succeeded nor failed, e.g. a full queue."""
+        with self._lock:
+            self._probing = False
+
+
+def _never_sent(error):
+    """True if a failed request did not get as far as sending its body.
+
+    Connection refused, DNS, connect timeout and TLS handshake failures are;
+    a read timeout or a dropped connection may come after Heygen acted.
+    """
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, (NewConnectionError,
+                                                                               ConnectTimeoutError))
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class HeygenClient:
+    """Thin wrapper around a pooled ``requests.Session`` for Heygen.
+
+    - At most ``max_concurrency`` requests are in flight; callers wait up to
+      ``queue_timeout`` for a slot and then fail fast instead of piling up.
+    - Identical GETs that are already in flight are coalesced: later callers
+      wait for the first one and share its response.
+    - Retries happen in one place, the urllib3 ``Retry`` policy on the
+      session, and only for idempotent requests.
+    - Every endpoint has its own ``CircuitBreaker``; transport errors and
+      5xx responses count as failures, and an open circuit raises
+      ``CircuitOpenError`` at once instead of tying up a worker thread.
+    - Requests are spread over the accounts in ``keys``, a ``KeyPool`` or a
+      single API key. Responses carry the id of the key that sent them as
+      ``response.key_id``; pass it back as ``key_id`` for calls about a
+      video that account owns.
+    """
+
+    def __init__(self, keys, base_url=DEFAULT_BASE_URL, max_concurrency=8,
+                 queue_timeout=10.0, verify=True, retries=2, failure_threshold=5, reset_timeout=30.0):
+        self.keys = keys if isinstance(keys, KeyPool) else KeyPool([keys])
+        self.base_url = base_url.rstrip('/')
+        self.verify = verify
+        self.queue_timeout = queue_timeout
+
+        self.session = requests.Session()
+        retry_strategy = Retry(
+            total=retries,
+            backoff_factor=0.5,  # wait 0.5, 1 seconds between retries
+            # 429s go back to the caller so the key pool can cool that key down
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET'],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy,
+                              pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+
+        self.requests_sent = 0
+        self.coalesced = 0
+
+    def headers(self, api_key, extra=None):
+        headers = {
+            'x-api-key': api_key,
+            'accept': 'application/json'
+        }
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def breaker(self, endpoint):
+        with self._inflight_lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold,
+                                                                    self.reset_timeout)
+            return breaker
+
+    def circuit_states(self):
+        """``{endpoint: state}`` for every endpoint called so far."""
+        with self._inflight_lock:
+            breakers = dict(self._breakers)
+        return {endpoint: breaker.state for endpoint, breaker in breakers.items()}
+
+    def open_circuits(self):
+        """Endpoints currently failing fast; half-open ones accept a probe and are not listed."""
+        return sorted(endpoint for endpoint, state in self.circuit_states().items() if state == CIRCUIT_OPEN)
+
+    def request(self, method, endpoint, params=None, json=None, headers=None, key_id=None):
+        """Send one request and return the ``requests.Response``.
+
+        Non-2xx responses are returned as-is; only transport errors, a
+        full concurrency queue and an open circuit raise ``HeygenError``.
+        """
+        if method != 'GET':
+            return self._send(method, endpoint, params, json, headers, key_id)
+
+        key = (endpoint, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())), key_id)
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+                UPSTREAM_COALESCED.inc(endpoint=endpoint)
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self._send(method, endpoint, params, json, headers, key_id)
+            return call.response
+        except Exception as e:
+            # Followers re-raise the leader's error rather than getting None
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _send(self, method, endpoint, params, json, headers, key_id=None):
+        started = time.perf_counter()
+        # A video's owner key if we know it; otherwise the pool's pick
+        api_key = self.keys.get(key_id) or self.keys.choose(spends_credits=method == 'POST')
+        if api_key is None:
+            raise HeygenError("No Heygen API key configured", unsent=True)
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            UPSTREAM_SHORT_CIRCUITED.inc(endpoint=endpoint)
+            raise CircuitOpenError(endpoint, breaker.retry_after())
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            breaker.release()
+            UPSTREAM_REJECTED.inc(endpoint=endpoint)
+            raise HeygenError(f"Too many concurrent Heygen requests ({endpoint})", unsent=True)
+        self.keys.begin(api_key)
+        sent = time.perf_counter()
+        status = 'error'
+        retry_after = None
+        try:
+            self.requests_sent += 1
+            response = self.session.request(
+                method,
+                f'{self.base_url}/{endpoint}',
+                params=params,
+                json=json,
+                headers=self.headers(api_key.key, headers),
+                timeout=ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT),
+                verify=self.verify
+            )
+            status = response.status_code
+            response.key_id = api_key.id
+            if status == 429:
+                retry_after = _retry_after(response)
+            if status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            retries = getattr(getattr(response, 'raw', None), 'retries', None)
+            if retries is not None and retries.history:
+                UPSTREAM_RETRIES.inc(len(retries.history), endpoint=endpoint)
+            return response
+        except requests.RequestException as e:
+            breaker.record_failure()
+            raise HeygenError(f"Error calling Heygen {endpoint}: {str(e)}", unsent=_never_sent(e)) from e
+        finally:
+            self._slots.release()
+            self.keys.finish(api_key, status, retry_after)
+            now = time.perf_counter()
+            logger.info("Heygen %s %s -> %s in %.0fms", method, endpoint, status, (now - sent) * 1000,
+                        extra={'endpoint': endpoint, 'status': status, 'key_id': api_key.id, 'sampled': True})
+            UPSTREAM_LATENCY.observe(now - sent, endpoint=endpoint)
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+            record_timing('heygen', now - started)
+
+    # Endpoints
+
+    def get_avatars(self, extra_headers=None):
+        return self.request('GET', 'v2/avatars', headers=extra_headers)
+
+    def get_voices(self, extra_headers=None):
+        return self.request('GET', 'v2/voices', headers=extra_headers)
+
+    def list_videos(self, token=None, limit=100, key_id=None):
+        """Return the ``data`` object of one ``video.list`` page."""
+        params = {'limit': limit}
+        if token:
+            params['token'] = token
+        response = self.request('GET', 'v1/video.list', params=params, key_id=key_id)
+        if response.status_code != 200:
+            raise HeygenError(f"Failed to fetch videos from Heygen: {response.status_code} - {response.text[:500]}",
+                              response.status_code, response)
+        return response.json().get('data', {}) or {}
+
+    def get_video_status(self, video_id, key_id=None):
+        """Return the ``data`` object of ``video_status.get`` for one video."""
+        response = self.request('GET', 'v1/video_status.get', params={'video_id': video_id}, key_id=key_id)
+        if response.status_code != 200:
+            raise HeygenError(f"Status request failed: {response.status_code} - {response.text[:500]}",
+                              response.status_code, response)
+        return response.json().get('data', {}) or {}
+
+    def generate_video(self, payload):
+        return self.request('POST', 'v2/video/generate', json=payload,
+                            headers={'Content-Type': 'application/json'})
+
+    def get_remaining_quota(self, key_id):
+        """Remaining credits of the account behind ``key_id``."""
+        response = self.request('GET', 'v2/user/remaining_quota', key_id=key_id)
+        if response.status_code != 200:
+            raise HeygenError(f"Quota request failed: {response.status_code} - {response.text[:500]}",
+                              response.status_code, response)
+        return (response.json().get('data') or {}).get('remaining_quota')
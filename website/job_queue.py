@@ -0,0 +1,386 @@
+"""Durable queue for video generation requests, stored in videos.db."""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from heygen_client import CircuitOpenError, HeygenError
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'QUEUED'
+JOB_DISPATCHING = 'DISPATCHING'
+JOB_SUBMITTED = 'SUBMITTED'
+JOB_FAILED = 'FAILED'
+
+CREATE_JOBS = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        video_id TEXT,
+        error TEXT,
+        batch_id TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+'''
+
+CREATE_JOBS_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_next_attempt
+    ON jobs (status, next_attempt_at)
+'''
+
+CREATE_JOBS_BATCH_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON jobs (batch_id)
+'''
+
+INSERT_JOB = '''
+    INSERT INTO jobs (idempotency_key, payload, status, batch_id, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(idempotency_key) DO NOTHING
+'''
+
+SELECT_JOB_BY_KEY = 'SELECT * FROM jobs WHERE idempotency_key = ?'
+
+CLAIM_JOB = '''
+    UPDATE jobs
+    SET status = ?, attempts = attempts + 1, updated_at = ?
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE status = ? AND next_attempt_at <= ?
+        ORDER BY id LIMIT 1
+    )
+    RETURNING *
+'''
+
+FINISH_JOB = '''
+    UPDATE jobs
+    SET status = ?, video_id = ?, error = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+RETRY_JOB = '''
+    UPDATE jobs
+    SET status = ?, next_attempt_at = ?, error = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+# Error prefix for submissions that may or may not have reached Heygen
+AMBIGUOUS_ERROR = "Heygen may have accepted this video; check the video list before resubmitting"
+
+# Bad gateway and gateway timeout: the request may have been handled upstream
+AMBIGUOUS_STATUSES = (502, 504)
+
+# Jobs a worker claimed but never finished, e.g. across a restart in the
+# middle of the generate call. Heygen may have accepted that call, so they
+# are failed rather than sent again.
+SELECT_STALE_JOBS = 'SELECT * FROM jobs WHERE status = ? AND updated_at < ?'
+
+FAIL_STALE_JOB = '''
+    UPDATE jobs SET status = ?, error = ?, updated_at = ?
+    WHERE id = ? AND status = ?
+'''
+
+# Longer than a claimed job can legitimately stay DISPATCHING: the token
+# bucket wait, a concurrency slot and the 30s generate read timeout
+DEFAULT_STALE_AFTER = 120
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+class TokenBucket:
+    """Client-side rate limit for upstream submissions.
+
+    Refills ``rate`` tokens per second up to ``capacity``. ``pause`` empties
+    the bucket until a deadline, e.g. the ``Retry-After`` of a 429.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def acquire(self, stop_event=None):
+        """Block until a token is available; returns False if stopped first."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    elapsed = now - max(self._updated, self._paused_until)
+                    self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+def retry_after_seconds(response, default):
+    """Parse a numeric ``Retry-After`` header, falling back to ``default``."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+class JobQueue:
+    """Persists generation requests and dispatches them from worker threads.
+
+    ``enqueue`` only writes a row, so request threads never wait on Heygen.
+    Workers claim jobs one at a time, respect a shared token bucket and any
+    ``Retry-After`` from upstream, and retry with backoff only what is safe
+    to send again: errors raised before the request left and 5xx answers
+    other than gateway errors. Generation is not idempotent upstream, so a
+    timeout, 502 or 504 after sending fails the job rather than risk a
+    second paid video.
+    Each job has a unique idempotency key, so resubmitting the same form or
+    API call returns the existing job instead of creating a second video.
+
+    ``submit(payload)`` must return a ``requests.Response``;
+    ``on_submitted(job, video_id, key_id)`` and ``on_failed(job, error)`` run
+    inside the transaction that records the outcome. ``key_id`` identifies
+    the API key that created the video, from ``response.key_id``.
+    """
+
+    def __init__(self, store, submit, on_submitted=None, on_failed=None,
+                 workers=2, rate=1.0, burst=5, max_attempts=5, base_backoff=2.0, pause_on_rate_limit=True,
+                 stale_after=DEFAULT_STALE_AFTER):
+        self.store = store
+        self.submit = submit
+        self.on_submitted = on_submitted
+        self.on_failed = on_failed
+        self.worker_count = workers
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        # With several API keys a 429 only benches one key; the others keep going
+        self.pause_on_rate_limit = pause_on_rate_limit
+        # Only jobs this old are treated as abandoned; others may still be
+        # in flight in another gunicorn worker
+        self.stale_after = stale_after
+        self._last_recovery = 0.0
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+        self.dispatched = 0
+        self.rate_limited = 0
+
+    def init_schema(self):
+        with self.store.transaction() as conn:
+            conn.execute(CREATE_JOBS)
+            conn.execute(CREATE_JOBS_INDEX)
+        self.store.add_column('jobs', 'batch_id', 'TEXT')
+        with self.store.transaction() as conn:
+            conn.execute(CREATE_JOBS_BATCH_INDEX)
+
+    def enqueue(self, payload, idempotency_key=None, batch_id=None):
+        """Queue one ``v2/video/generate`` payload.
+
+        Returns ``(job_row, created)``; ``created`` is False when a job with
+        the same idempotency key already exists.
+        """
+        key = idempotency_key or new_idempotency_key()
+        now = datetime.now().isoformat()
+        with self.store.transaction() as conn:
+            cursor = conn.execute(INSERT_JOB, (key, json.dumps(payload), JOB_QUEUED, batch_id, now, now))
+            created = cursor.rowcount == 1
+            job = conn.execute(SELECT_JOB_BY_KEY, (key,)).fetchone()
+        self._wake.set()
+        return job, created
+
+    def get(self, job_id):
+        return self.store.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def depth(self):
+        """Number of jobs waiting for or in dispatch."""
+        return self.store.execute(
+            'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (JOB_QUEUED, JOB_DISPATCHING)
+        ).fetchone()[0]
+
+    def status_counts(self):
+        counts = dict.fromkeys((JOB_QUEUED, JOB_DISPATCHING, JOB_SUBMITTED, JOB_FAILED), 0)
+        for row in self.store.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status'):
+            counts[row['status']] = row['count']
+        return counts
+
+    # Workers
+
+    def start(self):
+        with self._lock:
+            if any(t.is_alive() for t in self._threads):
+                return
+            self._stop.clear()
+            self._recover_stale()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.worker_count)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def _recover_stale(self):
+        """Fail jobs left DISPATCHING for longer than ``stale_after``."""
+        self._last_recovery = time.monotonic()
+        cutoff = (datetime.now() - timedelta(seconds=self.stale_after)).isoformat()
+        error = f"{AMBIGUOUS_ERROR}: the worker sending it stopped"
+        for job in self.store.execute(SELECT_STALE_JOBS, (JOB_DISPATCHING, cutoff)).fetchall():
+            with self.store.transaction() as conn:
+                # Another process may be recovering the same job
+                failed = conn.execute(FAIL_STALE_JOB, (JOB_FAILED, error, datetime.now().isoformat(),
+                                                       job['id'], JOB_DISPATCHING)).rowcount
+                if failed and self.on_failed:
+                    self.on_failed(job, error)
+            if failed:
+                logger.warning("Job %s failed: %s", job['id'], error, extra={'job_id': job['id']})
+
+    def _claim(self):
+        now = datetime.now().isoformat()
+        with self.store.transaction() as conn:
+            return conn.execute(CLAIM_JOB, (JOB_DISPATCHING, now, JOB_QUEUED, time.time())).fetchone()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("Error claiming job")
+                job = None
+            if job is None:
+                if time.monotonic() - self._last_recovery >= self.stale_after:
+                    try:
+                        self._recover_stale()
+                    except Exception:
+                        logger.exception("Error recovering stale jobs")
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            if not self.bucket.acquire(self._stop):
+                # Shutting down; hand the job back untouched
+                self._retry(job, 0, None)
+                return
+            try:
+                self._dispatch(job)
+            except Exception as e:
+                logger.exception("Error dispatching job %s", job['id'], extra={'job_id': job['id']})
+                # Never leave it DISPATCHING, where a restart would send it again
+                try:
+                    self._fail(job, f"Error dispatching job: {str(e)}")
+                except Exception:
+                    logger.exception("Error failing job %s", job['id'], extra={'job_id': job['id']})
+
+    def _dispatch(self, job):
+        try:
+            response = self.submit(json.loads(job['payload']))
+        except CircuitOpenError as e:
+            # Nothing was sent; wait out the outage without using up attempts
+            self.bucket.pause(e.retry_after)
+            with self.store.transaction() as conn:
+                conn.execute('UPDATE jobs SET attempts = attempts - 1 WHERE id = ?', (job['id'],))
+                self._retry(job, e.retry_after, str(e))
+            return
+        except HeygenError as e:
+            if e.unsent:
+                self._retry_or_fail(job, str(e))
+            else:
+                # Heygen may have created (and charged for) the video; a retry could duplicate it
+                self._fail(job, f"{AMBIGUOUS_ERROR}: {str(e)}")
+            return
+
+        if response.status_code == 200:
+            try:
+                video_id = (response.json().get('data') or {}).get('video_id')
+            except (ValueError, AttributeError):
+                self._fail(job, f"{AMBIGUOUS_ERROR}: unreadable response {response.text[:200]!r}")
+                return
+            if video_id:
+                self._finish(job, video_id, getattr(response, 'key_id', None))
+            else:
+                self._fail(job, "Failed to get video ID from response")
+        elif response.status_code == 429:
+            self.rate_limited += 1
+            delay = retry_after_seconds(response, self.base_backoff * 2 ** job['attempts'])
+            if self.pause_on_rate_limit:
+                self.bucket.pause(delay)
+            # Rate limiting is not the job's fault; don't count the attempt
+            with self.store.transaction() as conn:
+                conn.execute('UPDATE jobs SET attempts = attempts - 1 WHERE id = ?', (job['id'],))
+                self._retry(job, delay, 'Rate limited by Heygen')
+        elif response.status_code in AMBIGUOUS_STATUSES:
+            # A gateway gave up waiting; Heygen behind it may still have created the video
+            self._fail(job, f"{AMBIGUOUS_ERROR}: {response.status_code} - {response.text[:500]}")
+        elif response.status_code >= 500:
+            self._retry_or_fail(job, f"{response.status_code} - {response.text[:500]}")
+        else:
+            self._fail(job, f"Failed to create video: {response.status_code} - {response.text[:500]}")
+
+    def _finish(self, job, video_id, key_id=None):
+        self.dispatched += 1
+        try:
+            with self.store.transaction() as conn:
+                conn.execute(FINISH_JOB, (JOB_SUBMITTED, video_id, None, datetime.now().isoformat(), job['id']))
+                if self.on_submitted:
+                    self.on_submitted(job, video_id, key_id)
+        except Exception:
+            logger.exception("Error recording submitted job %s", job['id'],
+                             extra={'job_id': job['id'], 'video_id': video_id})
+            # The video exists upstream either way; the list sync picks it up
+            with self.store.transaction() as conn:
+                conn.execute(FINISH_JOB, (JOB_SUBMITTED, video_id, None, datetime.now().isoformat(), job['id']))
+
+    def _fail(self, job, error):
+        logger.warning("Job %s failed: %s", job['id'], error, extra={'job_id': job['id']})
+        with self.store.transaction() as conn:
+            conn.execute(FINISH_JOB, (JOB_FAILED, None, error, datetime.now().isoformat(), job['id']))
+            if self.on_failed:
+                self.on_failed(job, error)
+
+    def _retry(self, job, delay, error):
+        with self.store.transaction() as conn:
+            conn.execute(RETRY_JOB, (JOB_QUEUED, time.time() + delay, error,
+                                     datetime.now().isoformat(), job['id']))
+
+    def _retry_or_fail(self, job, error):
+        if job['attempts'] >= self.max_attempts:
+            self._fail(job, error)
+            return
+        delay = self.base_backoff * 2 ** (job['attempts'] - 1)
+        logger.info("Job %s attempt %s failed, retrying in %ss: %s", job['id'], job['attempts'], delay, error,
+                    extra={'job_id': job['id'], 'attempts': job['attempts']})
+        self._retry(job, delay, error)
@@ -0,0 +1,164 @@
+"""Pool of Heygen API keys, one per account, shared by every upstream call."""
+import hashlib
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a key sits out after a 429 that came without Retry-After
+DEFAULT_COOLDOWN = 30.0
+
+
+def key_id(api_key):
+    """Stable identifier for a key, safe to store and log."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class ApiKey:
+    """One account's key and what the pool knows about its quota."""
+
+    def __init__(self, api_key):
+        self.key = api_key
+        self.id = key_id(api_key)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        # Remaining credits from v2/user/remaining_quota; None until fetched
+        self.remaining = None
+        self.cooldown_until = 0.0
+
+    def cooling(self, now=None):
+        return self.cooldown_until > (now or time.monotonic())
+
+
+class KeyPool:
+    """Spreads requests over several Heygen accounts.
+
+    ``choose()`` picks a random key weighted by spare capacity. Keys that
+    were answered with a 429 sit out until their ``Retry-After`` passes. For
+    requests that spend credits, such as video generation, the weight is the
+    remaining quota and exhausted keys are skipped. Reads are spread evenly.
+    Either way, keys with more requests in flight are picked less often.
+
+    Status calls for an existing video must use the key of the account
+    that owns it; pass that key's id to ``get``.
+    """
+
+    def __init__(self, api_keys, fetch_quota=None, refresh_interval=300, cooldown=DEFAULT_COOLDOWN):
+        # fetch_quota(key_id) -> remaining credits as a number
+        keys = []
+        for api_key in api_keys:
+            if api_key and key_id(api_key) not in {key.id for key in keys}:
+                keys.append(ApiKey(api_key))
+        self.keys = keys
+        self._by_id = {key.id: key for key in keys}
+        self.fetch_quota = fetch_quota
+        self.refresh_interval = refresh_interval
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key_id):
+        return self._by_id.get(key_id)
+
+    def choose(self, spends_credits=False):
+        """Pick the key for a new request, or None if the pool is empty."""
+        if not self.keys:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            candidates = [key for key in self.keys if not key.cooling(now)]
+            if spends_credits:
+                funded = [key for key in candidates if key.remaining is None or key.remaining > 0]
+                candidates = funded or candidates
+            if not candidates:
+                # Everything is rate limited; use the key that recovers first
+                return min(self.keys, key=lambda key: key.cooldown_until)
+            weights = [self._capacity(key, candidates, spends_credits) / (1 + key.in_flight)
+                       for key in candidates]
+            return self._random.choices(candidates, weights)[0]
+
+    def _capacity(self, key, candidates, spends_credits):
+        if not spends_credits:
+            return 1.0
+        known = [other.remaining for other in candidates if other.remaining is not None]
+        if key.remaining is not None:
+            return max(key.remaining, 1.0)
+        # Unknown quota counts as an average key rather than starving or flooding it
+        return max(sum(known) / len(known), 1.0) if known else 1.0
+
+    def begin(self, key):
+        with self._lock:
+            key.in_flight += 1
+            key.requests += 1
+
+    def finish(self, key, status, retry_after=None):
+        """Record the outcome of a request sent with ``key``."""
+        with self._lock:
+            key.in_flight -= 1
+            if status == 429:
+                key.rate_limited += 1
+                key.cooldown_until = time.monotonic() + (retry_after or self.cooldown)
+            elif status == 'error' or (isinstance(status, int) and status >= 500):
+                key.errors += 1
+        if status == 429:
+            logger.info("Heygen key %s rate limited for %.0fs", key.id, retry_after or self.cooldown,
+                        extra={'key_id': key.id})
+
+    def set_remaining(self, key_id, remaining):
+        key = self.get(key_id)
+        if key is not None:
+            with self._lock:
+                key.remaining = remaining
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'id': key.id,
+                'requests': key.requests,
+                'errors': key.errors,
+                'rate_limited': key.rate_limited,
+                'in_flight': key.in_flight,
+                'remaining': key.remaining,
+                'cooling_down_for': round(max(0.0, key.cooldown_until - now), 1),
+            } for key in self.keys]
+
+    # Background quota refresh
+
+    def refresh_quotas(self):
+        for key in self.keys:
+            try:
+                self.set_remaining(key.id, self.fetch_quota(key.id))
+            except Exception as e:
+                logger.warning("Error fetching remaining quota for key %s: %s", key.id, e,
+                               extra={'key_id': key.id})
+
+    def start(self):
+        if self.fetch_quota is None or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='key-quota-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_quotas()
+            self._stop.wait(self.refresh_interval)
@@ -0,0 +1,138 @@
+"""JSON logging written by a background thread.
+
+Request and worker threads only put records on a queue; a
+``QueueListener`` thread redacts, truncates, serializes and writes them.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Header and query-string forms an API key may appear in
+_SECRET_PATTERNS = (
+    re.compile(r"""(?i)(x-api-key['"]?\s*[:=]\s*['"]?)([^'",\s}]+)"""),
+    re.compile(r"""(?i)(api_key=)([^&\s'"]+)"""),
+)
+
+REDACTED = '[REDACTED]'
+
+_listener = None
+_lock = threading.Lock()
+
+
+class RedactingFilter(logging.Filter):
+    """Masks secrets and truncates long strings in the message and extra fields."""
+
+    def __init__(self, secrets=(), max_length=1000):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret]
+        self.max_length = max_length
+
+    def clean(self, value, max_length=None):
+        if not isinstance(value, str):
+            return value
+        max_length = max_length or self.max_length
+        for secret in self.secrets:
+            value = value.replace(secret, REDACTED)
+        for pattern in _SECRET_PATTERNS:
+            value = pattern.sub(rf'\1{REDACTED}', value)
+        if len(value) > max_length:
+            value = f'{value[:max_length]}... [{len(value) - max_length} more characters]'
+        return value
+
+    def filter(self, record):
+        record.msg = self.clean(record.msg)
+        if record.exc_text:
+            # Tracebacks get more room than messages
+            record.exc_text = self.clean(record.exc_text, self.max_length * 10)
+        for key, value in list(vars(record).items()):
+            if key not in _RECORD_ATTRS:
+                setattr(record, key, self.clean(value))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps ``rate`` of the records logged with ``extra={'sampled': True}``.
+
+    Meant for events that fire on every poll or request, logged at INFO
+    so the rate applies at the default level; warnings and errors are
+    always kept.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sampled':
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Does the cheap part on the calling thread and leaves formatting to the listener."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level='INFO', fmt='json', secrets=(), sample_rate=0.01, max_length=1000):
+    """Route the root logger through a queue to stdout; safe to call more than once."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        if fmt == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        output.addFilter(RedactingFilter(secrets, max_length))
+
+        records = queue.SimpleQueue()
+        handler = _QueueHandler(records)
+        handler.addFilter(SamplingFilter(sample_rate))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
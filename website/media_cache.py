@@ -0,0 +1,248 @@
+"""On-disk, content-addressed cache for remote preview images and thumbnails."""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:  # Resizing is skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Widths the proxy will resize to; anything else is rounded up to one of these
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+# Files read or written this recently are kept by eviction, so a path get
+# just returned is still there when the route sends it
+EVICT_GRACE = 60
+
+FORMATS = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+class MediaError(Exception):
+    """Raised when a remote image cannot be fetched or decoded."""
+
+
+def variant_width(requested):
+    """Snap a requested width to the nearest allowed variant, or None for the original."""
+    if not requested:
+        return None
+    for width in VARIANT_WIDTHS:
+        if requested <= width:
+            return width
+    return VARIANT_WIDTHS[-1]
+
+
+class MediaCache:
+    """Stores each remote image once, keyed by the SHA-256 of its bytes.
+
+    ``refs/`` maps a source URL to the hash of what it returned and is
+    refreshed after ``ref_ttl`` seconds; ``objects/`` holds the original and
+    its resized variants. Reads bump a file's mtime, and once the cache
+    grows past ``max_bytes`` the least recently used files are removed.
+    """
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, ref_ttl=24 * 3600,
+                 timeout=(3.05, 15)):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._size = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Paths
+
+    def _ref_path(self, url):
+        return self.root / 'refs' / hashlib.sha1(url.encode()).hexdigest()
+
+    def _object_path(self, digest, suffix=''):
+        return self.root / 'objects' / digest[:2] / f'{digest}{suffix}'
+
+    # Public API
+
+    def get(self, url, width=None, fmt='jpeg'):
+        """Return ``(path, mimetype, etag)`` for ``url`` at the given width.
+
+        Without Pillow, or for the original size, the source bytes are
+        served unchanged. So are images Pillow cannot decode, such as SVG.
+        """
+        try:
+            return self._get(url, width, fmt)
+        except FileNotFoundError:
+            # Evicted between the lookup and the read; the retry fetches it again
+            logger.info("%s was evicted while in use; fetching it again", url)
+        try:
+            return self._get(url, width, fmt)
+        except FileNotFoundError as e:
+            raise MediaError(f"{url} was evicted while in use: {str(e)}") from e
+
+    def _get(self, url, width, fmt):
+        digest, source_type = self._source(url)
+        width = variant_width(width)
+        if width is None or Image is None:
+            if not source_type.startswith('image/'):
+                raise MediaError(f"{url} is not an image ({source_type})")
+            path = self._object_path(digest)
+            return self._touch(path), source_type, digest
+
+        # _source already counted this lookup as a hit or a miss
+        path = self._object_path(digest, f'-{width}.{fmt}')
+        if path.exists():
+            return self._touch(path), FORMATS[fmt], f'{digest}-{width}.{fmt}'
+
+        try:
+            data = self._resize(self._touch(self._object_path(digest)), width, fmt)
+        except FileNotFoundError:
+            raise
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            if not source_type.startswith('image/'):
+                raise MediaError(f"{url} is not an image ({source_type}): {str(e)}") from e
+            logger.info("Serving %s unresized: %s", url, e)
+            return self._touch(self._object_path(digest)), source_type, digest
+        self._write(path, data)
+        return path, FORMATS[fmt], f'{digest}-{width}.{fmt}'
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size_bytes': self._current_size(),
+            'max_bytes': self.max_bytes,
+        }
+
+    # Internals
+
+    def _source(self, url):
+        """Return ``(digest, content_type)`` of the original image, fetching if needed."""
+        ref = self._ref_path(url)
+        fresh = self._read_ref(ref)
+        if fresh:
+            self.hits += 1
+            return fresh
+
+        # One download per URL even when many cards ask at once
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        try:
+            with url_lock:
+                return self._download(url, ref)
+        finally:
+            # Dropped only once released and the ref is written, so later
+            # callers either share this lock or find the ref
+            with self._lock:
+                if self._url_locks.get(url) is url_lock:
+                    del self._url_locks[url]
+
+    def _download(self, url, ref):
+        # Caller holds the URL's lock
+        fresh = self._read_ref(ref)
+        if fresh:
+            self.hits += 1
+            return fresh
+        self.misses += 1
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise MediaError(f"Error fetching {url}: {str(e)}") from e
+        if response.status_code != 200 or not response.content:
+            raise MediaError(f"Image request failed: {response.status_code}")
+
+        content_type = response.headers.get('Content-Type', 'application/octet-stream').split(';')[0]
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self._object_path(digest)
+        if not path.exists():
+            self._write(path, response.content)
+        self._write(ref, f'{digest}\n{content_type}'.encode())
+        return digest, content_type
+
+    def _read_ref(self, ref):
+        try:
+            if time.time() - ref.stat().st_mtime > self.ref_ttl:
+                return None
+            digest, content_type = ref.read_text().split('\n', 1)
+        except (OSError, ValueError):
+            return None
+        if not self._object_path(digest).exists():
+            return None
+        return digest, content_type
+
+    def _resize(self, source, width, fmt):
+        with Image.open(source) as image:
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            out = io.BytesIO()
+            image.save(out, format=fmt.upper(), quality=80)
+            return out.getvalue()
+
+    def _touch(self, path):
+        # Raises FileNotFoundError if the file was evicted, so get can refetch it
+        os.utime(path)
+        return path
+
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        if 'objects' not in path.parts:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+        if self._current_size() > self.max_bytes:
+            self._evict()
+
+    def _current_size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(f.stat().st_size for f in (self.root / 'objects').rglob('*') if f.is_file()) \
+                    if (self.root / 'objects').exists() else 0
+            return self._size
+
+    def _evict(self):
+        """Delete least recently used objects until the cache is at 90% of its budget."""
+        with self._lock:
+            files = []
+            for f in (self.root / 'objects').rglob('*'):
+                try:
+                    if f.is_file():
+                        stat = f.stat()
+                        files.append((stat.st_mtime, stat.st_size, f))
+                except OSError:  # Removed by a writer's rename
+                    pass
+            files.sort()
+            size = sum(s for _, s, _ in files)
+            target = self.max_bytes * 0.9
+            in_use = time.time() - EVICT_GRACE
+            for mtime, file_size, f in files:
+                if size <= target or mtime > in_use:
+                    break
+                try:
+                    f.unlink()
+                    size -= file_size
+                    self.evictions += 1
+                except OSError:
+                    pass
+            self._size = size
@@ -0,0 +1,160 @@
+"""Rendered-HTML fragment cache and response compression."""
+import gzip
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+# Smaller bodies do not fit fewer packets after compression
+MIN_COMPRESS_SIZE = 500
+
+
+class FragmentCache:
+    """LRU of rendered template output, grouped by namespace.
+
+    Every namespace carries a version, such as the avatar catalog version;
+    the first lookup with a new version drops everything cached under the
+    old one. Keys should include whatever else the output depends on, so a
+    changed video row simply misses.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_render(self, namespace, version, key, render):
+        with self._lock:
+            if self._versions.get(namespace, version) != version:
+                self._drop(namespace)
+                self.invalidations += 1
+            self._versions[namespace] = version
+            html = self._entries.get((namespace, key))
+            if html is not None:
+                self._entries.move_to_end((namespace, key))
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        # Rendered outside the lock; two threads may render the same key once
+        html = render()
+        with self._lock:
+            if self._versions.get(namespace) == version:
+                self._entries[(namespace, key)] = html
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
+
+    def invalidate(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+            else:
+                self._drop(namespace)
+            self.invalidations += 1
+
+    def _drop(self, namespace):
+        for key in [key for key in self._entries if key[0] == namespace]:
+            del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+            }
+
+
+class ResponseCompressor:
+    """Adds ETags, answers If-None-Match with 304 and compresses bodies.
+
+    Dynamic HTML and JSON get a strong ETag computed over the uncompressed
+    body, so a 304 skips sending it at all. Compressed bodies are kept
+    per ``(etag, encoding)``; repeated hits on an unchanged page or static
+    asset are not compressed again. Brotli is used when the ``brotli``
+    package is installed and the client accepts it.
+    """
+
+    def __init__(self, level=6, max_entries=256, max_body=2 * 1024 * 1024):
+        self.level = level
+        self.max_body = max_body
+        self.encodings = ('br', 'gzip') if brotli else ('gzip',)
+        self._compressed = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.not_modified = 0
+
+    def process(self, request, response):
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+            return response
+
+        if response.direct_passthrough:
+            # send_file output: static assets, already conditional on their own ETag
+            if response.content_length is None or response.content_length > self.max_body:
+                return response
+            response.direct_passthrough = False
+        elif response.is_streamed:
+            return response
+        elif not response.headers.get('ETag'):
+            response.add_etag()
+            if 'Cache-Control' not in response.headers:
+                response.headers['Cache-Control'] = 'no-cache'
+            response.make_conditional(request)
+            if response.status_code == 304:
+                self.not_modified += 1
+                return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        body = response.get_data()
+        if not encoding or len(body) < MIN_COMPRESS_SIZE:
+            return response
+
+        etag, _ = response.get_etag()
+        data = self._compress(etag, encoding, body)
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        # Byte ranges would index the uncompressed file, not these bytes
+        response.headers.pop('Accept-Ranges', None)
+        if etag:
+            # Same content, different bytes; If-None-Match compares weakly
+            response.set_etag(etag, weak=True)
+        self.compressed += 1
+        return response
+
+    def _compress(self, etag, encoding, body):
+        key = (etag, encoding)
+        if etag:
+            with self._lock:
+                data = self._compressed.get(key)
+                if data is not None:
+                    self._compressed.move_to_end(key)
+                    return data
+        if encoding == 'br':
+            data = brotli.compress(body, quality=min(self.level, 11))
+        else:
+            data = gzip.compress(body, compresslevel=self.level, mtime=0)
+        if etag:
+            with self._lock:
+                self._compressed[key] = data
+                while len(self._compressed) > self._max_entries:
+                    self._compressed.popitem(last=False)
+        return data
@@ -0,0 +1,204 @@
+// Title editing functions
+function startEditingTitle(videoId) {
+    const titleSpan = document.querySelector(`.video-title[data-video-id="${videoId}"]`);
+    const currentTitle = titleSpan.textContent;
+
+    // Create input field
+    const input = document.createElement('input');
+    input.type = 'text';
+    input.value = currentTitle;
+    input.className = 'form-control form-control-sm';
+    input.style.width = '200px';
+
+    // Create save button
+    const saveBtn = document.createElement('button');
+    saveBtn.className = 'btn btn-sm btn-success ms-2';
+    saveBtn.innerHTML = 'Save';
+    saveBtn.onclick = () => saveTitle(videoId, input.value);
+
+    // Create cancel button
+    const cancelBtn = document.createElement('button');
+    cancelBtn.className = 'btn btn-sm btn-secondary ms-2';
+    cancelBtn.innerHTML = 'Cancel';
+    cancelBtn.onclick = () => cancelEditing(videoId, currentTitle);
+
+    // Create button container
+    const btnContainer = document.createElement('div');
+    btnContainer.className = 'd-inline-block';
+    btnContainer.appendChild(saveBtn);
+    btnContainer.appendChild(cancelBtn);
+
+    // Replace title with input and buttons
+    titleSpan.innerHTML = '';
+    titleSpan.appendChild(input);
+    titleSpan.appendChild(btnContainer);
+
+    // Focus input
+    input.focus();
+    input.select();
+
+    // Hide edit button
+    const editBtn = titleSpan.nextElementSibling;
+    if (editBtn) editBtn.style.display = 'none';
+}
+
+async function saveTitle(videoId, newTitle) {
+    try {
+        const response = await fetch(`/update_video_details/${videoId}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+            body: `title=${encodeURIComponent(newTitle)}`
+        });
+
+        const data = await response.json();
+
+        if (response.ok) {
+            const titleSpan = document.querySelector(`.video-title[data-video-id="${videoId}"]`);
+            titleSpan.innerHTML = data.title;
+
+            // Show edit button
+            const editBtn = titleSpan.nextElementSibling;
+            if (editBtn) editBtn.style.display = '';
+        } else {
+            alert(data.error || 'Failed to update title');
+            cancelEditing(videoId, newTitle);
+        }
+    } catch (error) {
+        console.error('Error saving title:', error);
+        alert('Failed to save title');
+        cancelEditing(videoId, newTitle);
+    }
+}
+
+function cancelEditing(videoId, originalTitle) {
+    const titleSpan = document.querySelector(`.video-title[data-video-id="${videoId}"]`);
+    titleSpan.innerHTML = originalTitle;
+
+    // Show edit button
+    const editBtn = titleSpan.nextElementSibling;
+    if (editBtn) editBtn.style.display = '';
+}
+
+function isFinalStatus(status) {
+    return status === 'COMPLETED' || status === 'FAILED';
+}
+
+// A queued submission gets its real id once Heygen accepts it
+function renameVideoCard(videoCard, oldId, newId) {
+    videoCard.setAttribute('data-video-id', newId);
+    const titleSpan = videoCard.querySelector(`.video-title[data-video-id="${oldId}"]`);
+    if (titleSpan) titleSpan.setAttribute('data-video-id', newId);
+    const editBtn = videoCard.querySelector('.edit-title-btn');
+    if (editBtn) editBtn.onclick = () => startEditingTitle(newId);
+}
+
+// Apply a status change to a video card
+function applyVideoStatus(videoId, data) {
+    const videoCard = document.querySelector(`.video-card[data-video-id="${videoId}"]`);
+    if (!videoCard || !data.status) return;
+    if (data.video_id && data.video_id !== videoId) {
+        renameVideoCard(videoCard, videoId, data.video_id);
+        videoId = data.video_id;
+    }
+    videoCard.setAttribute('data-status', data.status.toLowerCase());
+
+    // Update status badge
+    const statusBadge = videoCard.querySelector('.video-status');
+    if (statusBadge) {
+        statusBadge.textContent = data.status;
+        statusBadge.className = `video-status status-${data.status.toLowerCase()}`;
+    }
+
+    // Update button
+    const actionButton = videoCard.querySelector('.action-button');
+    if (actionButton) {
+        if (data.status === 'COMPLETED') {
+            actionButton.href = `/play_video/${videoId}`;
+            actionButton.className = 'btn btn-primary action-button';
+            actionButton.textContent = 'Watch Video';
+            actionButton.disabled = false;
+        } else if (data.status === 'FAILED') {
+            actionButton.className = 'btn btn-danger action-button';
+            actionButton.textContent = 'Failed';
+            actionButton.disabled = true;
+        } else if (data.status === 'QUEUED') {
+            actionButton.className = 'btn btn-secondary action-button disabled';
+            actionButton.textContent = 'Queued';
+            actionButton.disabled = true;
+        } else {
+            actionButton.href = `/play_video/${videoId}`;
+            actionButton.className = 'btn btn-warning action-button';
+            actionButton.textContent = 'Watch Video';
+            actionButton.disabled = false;
+        }
+    }
+}
+
+function pendingVideoIds() {
+    return Array.from(document.querySelectorAll('.video-card[data-video-id]'))
+        .filter(card => !isFinalStatus(card.getAttribute('data-status').toUpperCase()))
+        .map(card => card.getAttribute('data-video-id'));
+}
+
+// Fallback: one batched request per tick for every pending video
+async function pollPendingVideos(repeat = true) {
+    const ids = pendingVideoIds();
+    if (ids.length === 0) return;
+
+    try {
+        const response = await fetch(`/check_video_status?ids=${ids.map(encodeURIComponent).join(',')}`);
+        if (response.ok) {
+            const data = await response.json();
+            for (const [videoId, video] of Object.entries(data.videos)) {
+                applyVideoStatus(videoId, video);
+            }
+        }
+    } catch (error) {
+        console.error('Error updating video status:', error);
+    }
+
+    if (repeat && pendingVideoIds().length > 0) {
+        setTimeout(pollPendingVideos, 5000); // Check every 5 seconds
+    }
+}
+
+let videoEvents = null;
+
+// Nothing left to wait for; free the server thread holding the stream
+function closeIdleVideoEvents() {
+    if (videoEvents && pendingVideoIds().length === 0) {
+        videoEvents.close();
+        videoEvents = null;
+    }
+}
+
+// Prefer a single pushed stream of status changes over polling
+function subscribeToVideoEvents() {
+    if (!window.EventSource) {
+        pollPendingVideos();
+        return;
+    }
+
+    const source = videoEvents = new EventSource('/events/videos');
+    source.addEventListener('video', event => {
+        const video = JSON.parse(event.data);
+        applyVideoStatus(video.id, video);
+        closeIdleVideoEvents();
+    });
+    source.onerror = () => {
+        // EventSource reconnects on its own; catch up on anything missed meanwhile
+        if (source.readyState === EventSource.CLOSED) {
+            pollPendingVideos();
+        }
+    };
+    // Pick up changes that happened before the stream opened
+    source.onopen = () => pollPendingVideos(false).then(closeIdleVideoEvents);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    if (pendingVideoIds().length > 0) {
+        subscribeToVideoEvents();
+    }
+});
@@ -0,0 +1,204 @@
+"""Background poller that keeps non-terminal videos in videos.db up to date."""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from video_store import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# (max video age in seconds, poll interval in seconds); older videos are
+# polled less often because they rarely change state any more.
+DEFAULT_SCHEDULE = (
+    (120, 5),
+    (600, 15),
+    (3600, 60),
+    (6 * 3600, 300),
+)
+SLOWEST_INTERVAL = 900
+
+# With Heygen webhooks configured, polling only reconciles missed callbacks
+RECONCILE_SCHEDULE = (
+    (600, 60),
+    (3600, 300),
+)
+
+
+def parse_timestamp(value):
+    """Return a datetime for an ISO timestamp from videos.db, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def status_error(result):
+    """Text of the ``error`` of a video_status.get result, or None."""
+    error = result.get('error')
+    if not error:
+        return None
+    if isinstance(error, dict):
+        return error.get('detail') or error.get('message') or str(error.get('code') or '') or None
+    return str(error)
+
+
+class StatusPoller:
+    """Polls ``video_status.get`` once per interval for every in-flight video.
+
+    The tracked set is loaded from the video store so any number of browser
+    tabs share the same upstream traffic. Results gathered during one tick
+    are written back in a single transaction, then handed to ``on_change``.
+    """
+
+    def __init__(self, store, fetch_status, schedule=DEFAULT_SCHEDULE,
+                 tick=1.0, reload_interval=30.0, on_change=None):
+        # fetch_status(video_id) -> dict with 'status' and 'video_url'
+        self.store = store
+        self.fetch_status = fetch_status
+        # on_change(list of {'id', 'status', 'video_url'}) after each write
+        self.on_change = on_change
+        self.schedule = schedule
+        self.tick = tick
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # video_id -> {'created_at', 'next_poll', 'failures', 'status', 'video_url'}
+        self._tracked = {}
+        self._last_reload = 0.0
+
+        self.polls = 0
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def track(self, video_id, created_at=None):
+        """Start polling a video right away, e.g. just after it was submitted."""
+        with self._lock:
+            if video_id not in self._tracked:
+                self._tracked[video_id] = {
+                    'created_at': created_at or datetime.now(),
+                    'next_poll': time.monotonic(),
+                    'failures': 0,
+                    'status': None,
+                    'video_url': None,
+                }
+        self._wake.set()
+
+    def untrack(self, video_id):
+        """Stop polling a video whose final status arrived some other way."""
+        with self._lock:
+            self._tracked.pop(video_id, None)
+
+    def tracked_count(self):
+        with self._lock:
+            return len(self._tracked)
+
+    def interval_for(self, created_at, now=None):
+        """Return the poll interval for a video of the given age."""
+        if created_at is None:
+            return self.schedule[0][1]
+        age = ((now or datetime.now()) - created_at).total_seconds()
+        for max_age, interval in self.schedule:
+            if age < max_age:
+                return interval
+        return SLOWEST_INTERVAL
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_reload >= self.reload_interval:
+                    self._reload()
+                self._poll_due()
+            except Exception:
+                logger.exception("Status poller error")
+            self._wake.wait(self.tick)
+            self._wake.clear()
+
+    def _reload(self):
+        rows = self.store.list_non_terminal()
+        now = time.monotonic()
+        with self._lock:
+            for row in rows:
+                if row['id'] not in self._tracked:
+                    self._tracked[row['id']] = {
+                        'created_at': parse_timestamp(row['created_at']),
+                        'next_poll': now,
+                        'failures': 0,
+                        'status': row['status'],
+                        'video_url': row['video_url'],
+                    }
+            self._last_reload = now
+
+    def _poll_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [video_id for video_id, state in self._tracked.items() if state['next_poll'] <= now]
+        if not due:
+            return
+
+        updates = []
+        for video_id in due:
+            if self._stop.is_set():
+                break
+            try:
+                result = self.fetch_status(video_id)
+                self.polls += 1
+                logger.info("Polled video %s: %s", video_id, result.get('status'),
+                            extra={'video_id': video_id, 'sampled': True})
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Error polling status for video %s: %s", video_id, e, extra={'video_id': video_id})
+                result = None
+
+            with self._lock:
+                state = self._tracked.get(video_id)
+                if state is None:
+                    continue
+                if result is None:
+                    state['failures'] += 1
+                    backoff = self.interval_for(state['created_at']) * 2 ** min(state['failures'], 5)
+                    state['next_poll'] = time.monotonic() + min(backoff, SLOWEST_INTERVAL)
+                    continue
+                state['failures'] = 0
+                status = (result.get('status') or 'PROCESSING').upper()
+                video_url = result.get('video_url') or ''
+                # Only rows whose state actually moved cost a write
+                if status != state['status'] or video_url != (state['video_url'] or ''):
+                    updates.append((video_id, status, video_url, result.get('thumbnail_url') or None,
+                                    result.get('duration'), status_error(result)))
+                    state['status'] = status
+                    state['video_url'] = video_url
+                if status in TERMINAL_STATUSES:
+                    del self._tracked[video_id]
+                else:
+                    state['next_poll'] = time.monotonic() + self.interval_for(state['created_at'])
+
+        if updates:
+            self.store.update_statuses(updates)
+            if self.on_change:
+                self.on_change([
+                    {'id': video_id, 'status': status, 'video_url': url}
+                    for video_id, status, url, *_ in updates
+                ])
@@ -0,0 +1,224 @@
+"""Pipeline throughput and time-to-complete reports built from video_status_history."""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import percentile
+from status_poller import parse_timestamp
+from video_store import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# In-flight videos without a status change for this long are reported as stalled
+DEFAULT_STALL_AFTER = 1800
+
+# Stalled videos listed by id in the report
+MAX_STALLED_LISTED = 20
+
+SELECT_WINDOW = '''
+    SELECT videos.id, videos.status AS current_status, videos.created_at,
+           videos.avatar_id, videos.dimension,
+           history.status, history.changed_at
+    FROM videos
+    LEFT JOIN video_status_history AS history ON history.video_id = videos.id
+    WHERE videos.created_at >= ?
+    ORDER BY videos.id, history.changed_at, history.rowid
+'''
+
+SELECT_IN_FLIGHT = '''
+    SELECT videos.id, videos.status, videos.created_at,
+           MAX(history.changed_at) AS changed_at
+    FROM videos
+    LEFT JOIN video_status_history AS history ON history.video_id = videos.id
+    WHERE videos.status IS NOT NULL AND videos.status NOT IN (?, ?)
+    GROUP BY videos.id
+'''
+
+
+def summarize(seconds):
+    return {
+        'count': len(seconds),
+        'p50': round(percentile(seconds, 50), 1) if seconds else None,
+        'p95': round(percentile(seconds, 95), 1) if seconds else None,
+    }
+
+
+class Bucket:
+    """Counts and completion times for one avatar, dimension or day."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.times = []
+
+    def as_dict(self, **key):
+        return dict(key, submitted=self.submitted, completed=self.completed, failed=self.failed,
+                    time_to_complete=summarize(self.times))
+
+
+class PipelineAnalytics:
+    """Aggregates video lifecycles into a throughput report.
+
+    A video's time to complete runs from its ``created_at`` (the moment it
+    was queued) to the first COMPLETED in its status history. Videos that
+    were already terminal when first seen, such as older ones found by the
+    list sync, count towards throughput but not towards timings. Time spent
+    in each in-flight status comes from consecutive history rows.
+
+    The report for the default window is rebuilt every ``interval`` seconds
+    by a background thread; other windows are computed on request.
+    """
+
+    def __init__(self, store, days=7, interval=300, stall_after=DEFAULT_STALL_AFTER):
+        self.store = store
+        self.days = days
+        self.interval = interval
+        self.stall_after = stall_after
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._report = None
+        self._built_at = 0.0
+
+        self.runs = 0
+        self.errors = 0
+
+    def report(self, days=None):
+        """The report for the last ``days`` days, from the cache when it is fresh."""
+        days = days or self.days
+        if days != self.days:
+            return self.compute(days)
+        with self._lock:
+            if self._report is not None and time.monotonic() - self._built_at < self.interval:
+                return self._report
+        return self.refresh()
+
+    def refresh(self):
+        report = self.compute(self.days)
+        with self._lock:
+            self._report = report
+            self._built_at = time.monotonic()
+        return report
+
+    def compute(self, days, now=None):
+        now = now or datetime.now()
+        since = now - timedelta(days=days)
+        started = time.perf_counter()
+
+        videos = {}
+        for row in self.store.execute(SELECT_WINDOW, (since.isoformat(),)):
+            video = videos.get(row['id'])
+            if video is None:
+                video = videos[row['id']] = {
+                    'status': row['current_status'],
+                    'created_at': parse_timestamp(row['created_at']),
+                    'avatar_id': row['avatar_id'],
+                    'dimension': row['dimension'],
+                    'history': [],
+                }
+            changed_at = parse_timestamp(row['changed_at'])
+            if row['status'] and changed_at:
+                video['history'].append((row['status'], changed_at))
+
+        totals = Bucket()
+        by_avatar, by_dimension, by_day = {}, {}, {}
+        stages = {}
+        for video in videos.values():
+            history = video['history']
+            buckets = [
+                totals,
+                by_avatar.setdefault(video['avatar_id'], Bucket()),
+                by_dimension.setdefault(video['dimension'], Bucket()),
+            ]
+            for bucket in buckets:
+                bucket.submitted += 1
+            if video['created_at']:
+                by_day.setdefault(video['created_at'].date().isoformat(), Bucket()).submitted += 1
+
+            for (status, entered), (_, left) in zip(history, history[1:]):
+                if status not in TERMINAL_STATUSES:
+                    stages.setdefault(status, []).append((left - entered).total_seconds())
+
+            outcome = next(((status, at) for status, at in history if status in TERMINAL_STATUSES), None)
+            if outcome is None:
+                continue
+            status, finished_at = outcome
+            day = by_day.setdefault(finished_at.date().isoformat(), Bucket())
+            observed = history[0][0] not in TERMINAL_STATUSES and video['created_at'] is not None
+            for bucket in buckets + [day]:
+                if status == 'COMPLETED':
+                    bucket.completed += 1
+                    if observed:
+                        bucket.times.append(max(0.0, (finished_at - video['created_at']).total_seconds()))
+                else:
+                    bucket.failed += 1
+
+        report = {
+            'generated_at': now.isoformat(),
+            'window': {'from': since.isoformat(), 'to': now.isoformat(), 'days': days},
+            'totals': dict(totals.as_dict(), in_flight=totals.submitted - totals.completed - totals.failed),
+            'stages': {status: summarize(seconds) for status, seconds in sorted(stages.items())},
+            'by_avatar': self._ranked(by_avatar, 'avatar_id'),
+            'by_dimension': self._ranked(by_dimension, 'dimension'),
+            'by_day': [bucket.as_dict(day=day) for day, bucket in sorted(by_day.items())],
+            'stalled': self._stalled(now),
+        }
+        report['compute_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+
+    def _ranked(self, buckets, name):
+        return [bucket.as_dict(**{name: key})
+                for key, bucket in sorted(buckets.items(), key=lambda item: -item[1].submitted)]
+
+    def _stalled(self, now):
+        """In-flight videos whose status has not moved for ``stall_after`` seconds."""
+        stalled = []
+        for row in self.store.execute(SELECT_IN_FLIGHT, TERMINAL_STATUSES):
+            since = parse_timestamp(row['changed_at']) or parse_timestamp(row['created_at'])
+            if since is None:
+                continue
+            age = (now - since).total_seconds()
+            if age >= self.stall_after:
+                stalled.append({'id': row['id'], 'status': row['status'], 'seconds_in_status': round(age)})
+        stalled.sort(key=lambda video: -video['seconds_in_status'])
+        by_status = {}
+        for video in stalled:
+            by_status[video['status']] = by_status.get(video['status'], 0) + 1
+        return {
+            'after_seconds': self.stall_after,
+            'count': len(stalled),
+            'by_status': by_status,
+            'oldest': stalled[:MAX_STALLED_LISTED],
+        }
+
+    # Background refresh
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='video-analytics', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                report = self.refresh()
+                self.runs += 1
+                logger.debug("Built pipeline report in %sms", report['compute_ms'])
+            except Exception:
+                self.errors += 1
+                logger.exception("Error building pipeline report")
+            self._stop.wait(self.interval)
@@ -0,0 +1,264 @@
+"""Bulk video creation from JSON, CSV or JSONL rows."""
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+MAX_BATCH_ROWS = 1000
+MAX_SCRIPT_LENGTH = 5000
+MIN_DIMENSION = 128
+MAX_DIMENSION = 3840
+DEFAULT_DIMENSION = (1280, 720)
+
+CREATE_BATCHES = '''
+    CREATE TABLE IF NOT EXISTS batches (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        total INTEGER NOT NULL,
+        created_at TIMESTAMP
+    )
+'''
+
+INSERT_BATCH = 'INSERT INTO batches (id, name, total, created_at) VALUES (?, ?, ?, ?)'
+
+SELECT_BATCH = 'SELECT * FROM batches WHERE id = ?'
+
+# Job state plus, once Heygen accepted the job, the state of its video
+SELECT_BATCH_PROGRESS = '''
+    SELECT jobs.status AS job_status, videos.status AS video_status, COUNT(*) AS count
+    FROM jobs
+    LEFT JOIN videos ON videos.id = jobs.video_id
+    WHERE jobs.batch_id = ?
+    GROUP BY jobs.status, videos.status
+'''
+
+
+class BatchError(Exception):
+    """Raised when a batch cannot be parsed or fails validation."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def build_video_payload(avatar_id, input_text, voice_id, width, height, caption=False):
+    """Request body for v2/video/generate"""
+    return {
+        "video_inputs": [
+            {
+                "character": {
+                    "type": "avatar",
+                    "avatar_id": avatar_id,
+                    "avatar_style": "normal"
+                },
+                "voice": {
+                    "type": "text",
+                    "input_text": input_text,
+                    "voice_id": voice_id
+                }
+            }
+        ],
+        "caption": caption,
+        "dimension": {
+            "width": width,
+            "height": height
+        }
+    }
+
+
+def payload_details(payload):
+    """Script, avatar and dimension of a v2/video/generate body, as stored in videos.db"""
+    inputs = payload.get('video_inputs') or [{}]
+    character = inputs[0].get('character') or {}
+    dimension = payload.get('dimension') or {}
+    return {
+        'input_text': (inputs[0].get('voice') or {}).get('input_text'),
+        'avatar_id': character.get('avatar_id') or character.get('talking_photo_id'),
+        'dimension': f"{dimension['width']}x{dimension['height']}"
+                     if dimension.get('width') and dimension.get('height') else None,
+    }
+
+
+def parse_batch_file(filename, data):
+    """Return the rows of an uploaded ``.csv``, ``.jsonl`` or ``.json`` file."""
+    try:
+        text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    except UnicodeDecodeError:
+        raise BatchError("File is not UTF-8 text")
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return list(csv.DictReader(io.StringIO(text)))
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        rows = []
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                raise BatchError(f"Line {line_no} is not valid JSON: {str(e)}")
+        return rows
+    if name.endswith('.json'):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise BatchError(f"File is not valid JSON: {str(e)}")
+        return data.get('videos', []) if isinstance(data, dict) else data
+    raise BatchError("Upload a .csv, .jsonl or .json file")
+
+
+def _parse_dimension(row):
+    if row.get('width') or row.get('height'):
+        return int(row.get('width')), int(row.get('height'))
+    dimension = row.get('dimension')
+    if not dimension:
+        return DEFAULT_DIMENSION
+    width, height = str(dimension).lower().split('x')
+    return int(width), int(height)
+
+
+def _parse_text(value):
+    """A text field from a CSV or JSON row; JSON numbers are taken as their digits."""
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise TypeError
+    return str(value).strip()
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def validate_rows(rows, avatar_index, voice_ids):
+    """Check every row against the cached catalogs before anything is queued.
+
+    Returns a list of ``{'payload', 'title'}`` items, or raises
+    ``BatchError`` listing every invalid row.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise BatchError("The batch contains no videos")
+    if len(rows) > MAX_BATCH_ROWS:
+        raise BatchError(f"A batch may contain at most {MAX_BATCH_ROWS} videos")
+
+    items = []
+    errors = []
+    for index, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': index, 'error': 'Row must be an object'})
+            continue
+
+        problems = []
+        fields = {}
+        for field, value in (('avatar_id', row.get('avatar_id')),
+                             ('voice_id', row.get('voice_id')),
+                             ('input_text', row.get('input_text') or row.get('script')),
+                             ('title', row.get('title'))):
+            try:
+                fields[field] = _parse_text(value)
+            except TypeError:
+                problems.append(f'{field} must be text')
+        if problems:
+            errors.append({'row': index, 'error': '; '.join(problems)})
+            continue
+        avatar_id, voice_id, input_text = fields['avatar_id'], fields['voice_id'], fields['input_text']
+
+        if not avatar_id:
+            problems.append('avatar_id is required')
+        elif avatar_index.get_avatar(avatar_id) is None:
+            problems.append(f'Unknown avatar_id {avatar_id}')
+        if not voice_id:
+            problems.append('voice_id is required')
+        elif voice_ids is not None and voice_id not in voice_ids:
+            problems.append(f'Unknown voice_id {voice_id}')
+        if not input_text:
+            problems.append('input_text is required')
+        elif len(input_text) > MAX_SCRIPT_LENGTH:
+            problems.append(f'input_text is longer than {MAX_SCRIPT_LENGTH} characters')
+
+        try:
+            width, height = _parse_dimension(row)
+            if not (MIN_DIMENSION <= width <= MAX_DIMENSION and MIN_DIMENSION <= height <= MAX_DIMENSION):
+                problems.append(f'dimension must be between {MIN_DIMENSION} and {MAX_DIMENSION} pixels')
+        except (TypeError, ValueError):
+            problems.append('dimension must look like 1280x720')
+
+        if problems:
+            errors.append({'row': index, 'error': '; '.join(problems)})
+            continue
+
+        items.append({
+            'payload': build_video_payload(avatar_id, input_text, voice_id, width, height,
+                                           _parse_bool(row.get('caption'))),
+            'title': fields['title'] or None,
+        })
+
+    if errors:
+        raise BatchError(f"{len(errors)} of {len(rows)} rows are invalid", errors)
+    return items
+
+
+class VideoBatches:
+    """Creates batches of queued videos and reports their combined progress.
+
+    ``queue_video(payload, name, idempotency_key, batch_id)`` queues one
+    generation job; every job of a batch is queued in one transaction, so a
+    batch is either accepted whole or not at all.
+    """
+
+    def __init__(self, store, queue_video):
+        self.store = store
+        self.queue_video = queue_video
+
+    def init_schema(self):
+        with self.store.transaction() as conn:
+            conn.execute(CREATE_BATCHES)
+
+    def create(self, items, name=None, idempotency_key=None):
+        """Queue validated items; returns the batch id."""
+        batch_id = uuid.uuid4().hex
+        now = datetime.now()
+        with self.store.transaction() as conn:
+            if idempotency_key:
+                existing = conn.execute(
+                    'SELECT batch_id FROM jobs WHERE idempotency_key = ?', (f'{idempotency_key}:1',)
+                ).fetchone()
+                if existing and existing['batch_id']:
+                    return existing['batch_id']
+            conn.execute(INSERT_BATCH, (batch_id, name, len(items), now.isoformat()))
+            for index, item in enumerate(items, start=1):
+                key = f'{idempotency_key}:{index}' if idempotency_key else None
+                title = item['title'] or f"{name or 'Batch'} #{index} ({now.strftime('%Y-%m-%d %H:%M')})"
+                self.queue_video(item['payload'], title, key, batch_id)
+        return batch_id
+
+    def progress(self, batch_id):
+        """Aggregate job and video states of a batch, or None if unknown."""
+        batch = self.store.execute(SELECT_BATCH, (batch_id,)).fetchone()
+        if batch is None:
+            return None
+
+        counts = {'queued': 0, 'processing': 0, 'completed': 0, 'failed': 0}
+        for row in self.store.execute(SELECT_BATCH_PROGRESS, (batch_id,)):
+            if row['job_status'] == 'FAILED' or row['video_status'] == 'FAILED':
+                counts['failed'] += row['count']
+            elif row['video_status'] == 'COMPLETED':
+                counts['completed'] += row['count']
+            elif row['job_status'] == 'SUBMITTED':
+                counts['processing'] += row['count']
+            else:
+                counts['queued'] += row['count']
+
+        finished = counts['completed'] + counts['failed']
+        return {
+            'batch_id': batch['id'],
+            'name': batch['name'],
+            'created_at': batch['created_at'],
+            'total': batch['total'],
+            'counts': counts,
+            'percent_complete': round(100.0 * finished / batch['total'], 1) if batch['total'] else 100.0,
+            'done': finished >= batch['total'],
+        }
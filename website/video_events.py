@@ -0,0 +1,84 @@
+"""In-process fan-out of video status changes to Server-Sent Event streams."""
+import collections
+import itertools
+import json
+import queue
+import threading
+
+
+class _Subscription(queue.Queue):
+    # Set when the broker dropped this subscriber for falling behind
+    dropped = False
+
+
+class VideoEventBroker:
+    """Publishes video status changes to every connected SSE client.
+
+    Each subscriber gets its own bounded queue; a client that stops reading
+    is dropped instead of holding up the publisher, and its stream ends so
+    the browser reconnects. The last ``history``
+    events are kept so a reconnecting browser can resume from
+    ``Last-Event-ID`` without missing a completion.
+    """
+
+    def __init__(self, history=200, queue_size=500):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = collections.deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self.queue_size = queue_size
+
+    def publish(self, video):
+        """Send one ``{'id', 'status', 'video_url', ...}`` change to all clients."""
+        with self._lock:
+            event = (next(self._ids), video)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                q.dropped = True
+                self.unsubscribe(q)
+
+    def publish_many(self, videos):
+        for video in videos:
+            self.publish(video)
+
+    def subscribe(self, last_event_id=None):
+        q = _Subscription(maxsize=self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event[0] > last_event_id:
+                        q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, last_event_id=None, heartbeat=15.0):
+        """Yield SSE-formatted messages until the client disconnects or is dropped.
+
+        A dropped client's stream ends; EventSource then reconnects with
+        ``Last-Event-ID`` and catches up from the history.
+        """
+        q = self.subscribe(last_event_id)
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield 'retry: 3000\n\n'
+            while not q.dropped:
+                try:
+                    event_id, video = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'id: {event_id}\nevent: video\ndata: {json.dumps(video)}\n\n'
+        finally:
+            self.unsubscribe(q)
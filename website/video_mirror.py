@@ -0,0 +1,333 @@
+"""Local copies of completed videos, so replays never go back to Heygen."""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+FILE_STORED = 'STORED'
+FILE_EVICTED = 'EVICTED'
+FILE_FAILED = 'FAILED'
+
+CHUNK_SIZE = 1024 * 1024
+# Background downloads given up after this many failures; playing the video retries it
+MAX_ATTEMPTS = 5
+
+CREATE_VIDEO_FILES = '''
+    CREATE TABLE IF NOT EXISTS video_files (
+        video_id TEXT PRIMARY KEY,
+        path TEXT,
+        size INTEGER,
+        sha256 TEXT,
+        content_type TEXT,
+        status TEXT NOT NULL,
+        last_accessed_at REAL,
+        created_at TIMESTAMP
+    )
+'''
+
+CREATE_VIDEO_FILES_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_video_files_status_accessed
+    ON video_files (status, last_accessed_at)
+'''
+
+# Newest completed videos that have never been mirrored
+SELECT_CANDIDATES = '''
+    SELECT videos.id, videos.video_url FROM videos
+    LEFT JOIN video_files ON video_files.video_id = videos.id
+    WHERE videos.status = 'COMPLETED' AND videos.video_url != ''
+      AND video_files.video_id IS NULL
+    ORDER BY videos.created_at DESC, videos.id DESC
+    LIMIT ?
+'''
+
+UPSERT_VIDEO_FILE = '''
+    INSERT INTO video_files (video_id, path, size, sha256, content_type, status, last_accessed_at, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(video_id) DO UPDATE SET
+        path = excluded.path,
+        size = excluded.size,
+        sha256 = excluded.sha256,
+        content_type = excluded.content_type,
+        status = excluded.status,
+        last_accessed_at = excluded.last_accessed_at
+'''
+
+SELECT_LRU = '''
+    SELECT * FROM video_files
+    WHERE status = ? AND video_id != ?
+    ORDER BY last_accessed_at
+'''
+
+EVICT_VIDEO_FILE = '''
+    UPDATE video_files SET status = ?, path = NULL WHERE video_id = ?
+'''
+
+
+class MirrorError(Exception):
+    """Raised when a video cannot be downloaded or fails verification."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class VideoMirror:
+    """Downloads COMPLETED videos into ``root`` from a background thread.
+
+    Files are streamed to disk in chunks, hashed with SHA-256 on the way and
+    checked against ``Content-Length`` before they are renamed into place.
+    The newest videos are mirrored while the store is under 90% of
+    ``max_bytes``; a video someone actually plays is always fetched, and
+    the least recently played files are evicted to make room for it.
+    Evicted videos are not mirrored again until they are played.
+
+    ``fetch_status(video_id)`` returns a fresh ``video_status.get`` payload
+    and is used when a stored upstream URL has expired.
+    """
+
+    def __init__(self, store, root, max_bytes=2 * 1024 * 1024 * 1024,
+                 fetch_status=None, interval=300, timeout=(3.05, 60)):
+        self.store = store
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.fetch_status = fetch_status
+        self.interval = interval
+        self.timeout = timeout
+        # Separate session: the Heygen API key must not be sent to the CDN
+        self.session = requests.Session()
+
+        self._requested = deque()
+        self._requested_lock = threading.Lock()
+        self._failures = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.downloads = 0
+        self.download_errors = 0
+        self.evictions = 0
+
+    def init_schema(self):
+        with self.store.transaction() as conn:
+            conn.execute(CREATE_VIDEO_FILES)
+            conn.execute(CREATE_VIDEO_FILES_INDEX)
+
+    # Lookups
+
+    def local_file(self, video_id):
+        """Return the ``video_files`` row of a stored, intact copy, or None."""
+        row = self.store.execute(
+            'SELECT * FROM video_files WHERE video_id = ? AND status = ?', (video_id, FILE_STORED)
+        ).fetchone()
+        if row is None:
+            return None
+        path = self.root / row['path']
+        try:
+            intact = path.stat().st_size == row['size']
+        except OSError:
+            intact = False
+        if not intact:
+            logger.warning("Mirrored file for %s is missing or truncated; dropping it", video_id,
+                           extra={'video_id': video_id})
+            self.store.execute('DELETE FROM video_files WHERE video_id = ?', (video_id,))
+            return None
+        # Recency only matters for eviction; skip the write on rapid replays
+        if time.time() - (row['last_accessed_at'] or 0) > 60:
+            self.store.execute('UPDATE video_files SET last_accessed_at = ? WHERE video_id = ?',
+                               (time.time(), video_id))
+        return row
+
+    def path_for(self, row):
+        return self.root / row['path']
+
+    def used_bytes(self):
+        return self.store.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM video_files WHERE status = ?', (FILE_STORED,)
+        ).fetchone()[0]
+
+    def stats(self):
+        return {
+            'downloads': self.downloads,
+            'download_errors': self.download_errors,
+            'evictions': self.evictions,
+            'used_bytes': self.used_bytes(),
+            'max_bytes': self.max_bytes,
+            'pending': len(self._requested),
+        }
+
+    # Downloads
+
+    def request(self, video_id):
+        """Mirror ``video_id`` ahead of the background backfill."""
+        with self._requested_lock:
+            if video_id not in self._requested:
+                self._requested.append(video_id)
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def mirror(self, video_id, video_url=None):
+        """Download one video; returns its ``video_files`` row."""
+        if video_url is None:
+            row = self.store.get(video_id)
+            video_url = row['video_url'] if row else ''
+        if not video_url:
+            raise MirrorError(f"Video {video_id} has no download URL")
+
+        try:
+            size, digest, content_type, relpath = self._download(video_id, video_url)
+        except MirrorError as e:
+            if not self.fetch_status or e.status_code not in (403, 404, 410):
+                raise
+            # Signed URLs expire; ask Heygen for a fresh one and try once more
+            data = self.fetch_status(video_id)
+            video_url = data.get('video_url') or ''
+            if not video_url:
+                raise
+            self.store.update_status(video_id, (data.get('status') or 'COMPLETED').upper(), video_url)
+            size, digest, content_type, relpath = self._download(video_id, video_url)
+
+        now = time.time()
+        self.store.execute(UPSERT_VIDEO_FILE, (video_id, relpath, size, digest, content_type,
+                                               FILE_STORED, now, datetime.now().isoformat()))
+        self.downloads += 1
+        self._evict(keep=video_id)
+        return self.store.execute('SELECT * FROM video_files WHERE video_id = ?', (video_id,)).fetchone()
+
+    def _download(self, video_id, url):
+        relpath = f'{video_id[:2]}/{video_id}.mp4'
+        path = self.root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+
+        try:
+            response = self.session.get(url, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise MirrorError(f"Error downloading {video_id}: {str(e)}") from e
+        try:
+            if response.status_code != 200:
+                raise MirrorError(f"Download of {video_id} failed: {response.status_code}", response.status_code)
+            expected = response.headers.get('Content-Length')
+            expected = int(expected) if expected and expected.isdigit() else None
+            if expected is not None and expected > self.max_bytes:
+                raise MirrorError(f"Video {video_id} is larger than the mirror quota")
+
+            sha256 = hashlib.sha256()
+            size = 0
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MirrorError(f"Video {video_id} is larger than the mirror quota")
+            if size == 0 or (expected is not None and size != expected):
+                raise MirrorError(f"Download of {video_id} was truncated ({size} of {expected} bytes)")
+            os.replace(tmp, path)
+        except (requests.RequestException, OSError) as e:
+            raise MirrorError(f"Error downloading {video_id}: {str(e)}") from e
+        finally:
+            response.close()
+            if tmp.exists():
+                tmp.unlink()
+
+        content_type = response.headers.get('Content-Type', 'video/mp4').split(';')[0]
+        return size, sha256.hexdigest(), content_type, relpath
+
+    def _evict(self, keep):
+        """Remove least recently played files until the store fits in ``max_bytes``."""
+        used = self.used_bytes()
+        if used <= self.max_bytes:
+            return
+        for row in self.store.execute(SELECT_LRU, (FILE_STORED, keep)).fetchall():
+            if used <= self.max_bytes:
+                break
+            try:
+                (self.root / row['path']).unlink()
+            except OSError:
+                pass
+            self.store.execute(EVICT_VIDEO_FILE, (FILE_EVICTED, row['video_id']))
+            used -= row['size']
+            self.evictions += 1
+
+    # Background worker
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='video-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _next(self):
+        """Next ``(video_id, video_url)`` to download, or None."""
+        with self._requested_lock:
+            while self._requested:
+                video_id = self._requested.popleft()
+                if not self._backing_off(video_id):
+                    return video_id, None
+
+        # Backfill only while there is room, so it does not churn played videos
+        if self.used_bytes() >= self.max_bytes * 0.9:
+            return None
+        for row in self.store.execute(SELECT_CANDIDATES, (20,)).fetchall():
+            if not self._backing_off(row['id']):
+                return row['id'], row['video_url']
+        return None
+
+    def _backing_off(self, video_id):
+        failure = self._failures.get(video_id)
+        return failure is not None and failure[1] > time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self._next()
+            except Exception:
+                logger.exception("Error selecting videos to mirror")
+                item = None
+            if item is None:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                continue
+
+            video_id, video_url = item
+            try:
+                self.mirror(video_id, video_url)
+                self._failures.pop(video_id, None)
+                logger.info("Mirrored video %s", video_id, extra={'video_id': video_id})
+            except Exception as e:
+                self.download_errors += 1
+                attempts = self._failures.get(video_id, (0, 0))[0] + 1
+                self._failures[video_id] = (attempts, time.time() + min(3600, 30 * 2 ** attempts))
+                logger.warning("Error mirroring video %s: %s", video_id, e, extra={'video_id': video_id})
+                if attempts >= MAX_ATTEMPTS:
+                    self._give_up(video_id)
+
+    def _give_up(self, video_id):
+        """Keep the backfill from selecting a video that keeps failing."""
+        self._failures.pop(video_id, None)
+        self.store.execute(
+            'INSERT INTO video_files (video_id, status, created_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(video_id) DO NOTHING',
+            (video_id, FILE_FAILED, datetime.now().isoformat())
+        )
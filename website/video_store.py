@@ -0,0 +1,575 @@
+"""Data access for videos.db."""
+import base64
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import Histogram, record_timing
+
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+# Rows for submissions still waiting in the job queue; nothing to poll yet
+QUEUED_STATUS = 'QUEUED'
+UNPOLLED_STATUSES = TERMINAL_STATUSES + (QUEUED_STATUS,)
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    # Safe with WAL: only the last transactions can be lost on power failure
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -8000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = ON',
+)
+
+CREATE_VIDEOS = '''
+    CREATE TABLE IF NOT EXISTS videos (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        status TEXT,
+        thumbnail_url TEXT,
+        video_url TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        duration TEXT,
+        error TEXT,
+        api_key_id TEXT,
+        input_text TEXT,
+        avatar_id TEXT,
+        dimension TEXT
+    )
+'''
+
+CREATE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_videos_created_at ON videos (created_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_videos_status_created_at ON videos (status, created_at, id)',
+)
+
+# Search over titles and scripts. The index reads its text from videos by
+# rowid; rebuild it with INSERT INTO videos_fts(videos_fts) VALUES('rebuild')
+# after a VACUUM, which may renumber rowids.
+CREATE_VIDEOS_FTS = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+        name, input_text,
+        content = 'videos', content_rowid = 'rowid',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+'''
+
+# Status and URL updates do not touch the index; only title and script changes do
+CREATE_FTS_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS videos_fts_insert AFTER INSERT ON videos BEGIN
+        INSERT INTO videos_fts (rowid, name, input_text) VALUES (new.rowid, new.name, new.input_text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS videos_fts_delete AFTER DELETE ON videos BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, name, input_text)
+        VALUES ('delete', old.rowid, old.name, old.input_text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS videos_fts_update AFTER UPDATE OF name, input_text ON videos BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, name, input_text)
+        VALUES ('delete', old.rowid, old.name, old.input_text);
+        INSERT INTO videos_fts (rowid, name, input_text) VALUES (new.rowid, new.name, new.input_text);
+    END
+    ''',
+)
+
+# One row per status a video entered, written by triggers so every writer
+# (poller, webhooks, list sync, job queue) is covered
+CREATE_STATUS_HISTORY = '''
+    CREATE TABLE IF NOT EXISTS video_status_history (
+        video_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        changed_at TIMESTAMP NOT NULL
+    )
+'''
+
+CREATE_STATUS_HISTORY_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_video_status_history ON video_status_history (video_id, changed_at)
+'''
+
+# Same format as datetime.now().isoformat(), to millisecond precision
+TRIGGER_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+
+CREATE_STATUS_TRIGGERS = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS video_status_insert AFTER INSERT ON videos
+    WHEN new.status IS NOT NULL BEGIN
+        INSERT INTO video_status_history (video_id, status, changed_at) VALUES (new.id, new.status, {TRIGGER_NOW});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS video_status_update AFTER UPDATE OF status ON videos
+    WHEN new.status IS NOT old.status AND new.status IS NOT NULL BEGIN
+        INSERT INTO video_status_history (video_id, status, changed_at) VALUES (new.id, new.status, {TRIGGER_NOW});
+    END
+    ''',
+    # Queued placeholders get the Heygen id once submitted
+    '''
+    CREATE TRIGGER IF NOT EXISTS video_status_rename AFTER UPDATE OF id ON videos
+    WHEN new.id IS NOT old.id BEGIN
+        UPDATE video_status_history SET video_id = new.id WHERE video_id = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS video_status_delete AFTER DELETE ON videos BEGIN
+        DELETE FROM video_status_history WHERE video_id = old.id;
+    END
+    ''',
+)
+
+CREATE_SYNC_STATE = '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP
+    )
+'''
+
+# Sort orders accepted by list_videos
+VIDEO_SORTS = {
+    'newest': 'created_at DESC, id DESC',
+    'oldest': 'created_at ASC, id ASC',
+    'name': 'name COLLATE NOCASE ASC, id ASC',
+    'status': 'status ASC, created_at DESC',
+}
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache reuses the compiled form on every call.
+SELECT_VIDEO = 'SELECT * FROM videos WHERE id = ?'
+
+SELECT_NON_TERMINAL = '''
+    SELECT id, created_at, status, video_url FROM videos
+    WHERE status IS NULL OR status NOT IN (?, ?, ?)
+'''
+
+INSERT_VIDEO = '''
+    INSERT INTO videos (id, name, status, input_text, avatar_id, dimension, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+UPSERT_VIDEO = '''
+    INSERT INTO videos (id, name, status, thumbnail_url, video_url,
+                        created_at, updated_at, api_key_id)
+    VALUES (:id, :name, :status, :thumbnail_url, :video_url,
+            :created_at, :updated_at, :api_key_id)
+    ON CONFLICT(id) DO UPDATE SET
+        name = COALESCE(name, excluded.name),
+        status = excluded.status,
+        video_url = excluded.video_url,
+        thumbnail_url = excluded.thumbnail_url,
+        updated_at = excluded.updated_at,
+        api_key_id = COALESCE(api_key_id, excluded.api_key_id)
+    WHERE status IS NOT excluded.status
+       OR video_url IS NOT excluded.video_url
+       OR thumbnail_url IS NOT excluded.thumbnail_url
+       OR (api_key_id IS NULL AND excluded.api_key_id IS NOT NULL)
+       OR (name IS NULL AND excluded.name IS NOT NULL)
+'''
+
+UPDATE_STATUS = '''
+    UPDATE videos
+    SET status = ?, video_url = ?,
+        thumbnail_url = COALESCE(?, thumbnail_url),
+        duration = COALESCE(?, duration), error = COALESCE(?, error), updated_at = ?
+    WHERE id = ?
+'''
+
+SELECT_STATE = 'SELECT value FROM sync_state WHERE key = ?'
+
+UPSERT_STATE = '''
+    INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+'''
+
+PROMOTE_QUEUED_VIDEO = '''
+    UPDATE videos
+    SET id = ?, status = ?, api_key_id = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+MERGE_QUEUED_NAME = '''
+    UPDATE videos
+    SET name = (SELECT name FROM videos WHERE id = :placeholder),
+        input_text = COALESCE(input_text, (SELECT input_text FROM videos WHERE id = :placeholder)),
+        avatar_id = COALESCE(avatar_id, (SELECT avatar_id FROM videos WHERE id = :placeholder)),
+        dimension = COALESCE(dimension, (SELECT dimension FROM videos WHERE id = :placeholder)),
+        api_key_id = COALESCE(:api_key_id, api_key_id)
+    WHERE id = :video_id
+'''
+
+MARK_FAILED = '''
+    UPDATE videos
+    SET status = ?, error = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+UPDATE_NAME = '''
+    UPDATE videos
+    SET name = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+
+# Page size limit of search_videos
+MAX_SEARCH_LIMIT = 100
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term.strip('"'))
+
+
+def encode_keyset(row):
+    """Opaque cursor for the position after ``row`` in created_at/id order."""
+    position = json.dumps([row['created_at'], row['id']])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_keyset(cursor):
+    """Return ``(created_at, id)`` from a cursor, or None if invalid."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, video_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return str(created_at), str(video_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+QUERY_LATENCY = Histogram('sqlite_query_duration_seconds',
+                          'Time spent in SQLite statements by leading keyword', ['operation'])
+
+
+def _operation(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every statement it executes."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            QUERY_LATENCY.observe(elapsed, operation=_operation(sql))
+            record_timing('db', elapsed)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            QUERY_LATENCY.observe(elapsed, operation=_operation(sql))
+            record_timing('db', elapsed)
+
+
+class VideoStore:
+    """Owns every connection to videos.db.
+
+    Each thread keeps one open connection configured for WAL, so concurrent
+    readers never block the writer and commits skip the per-transaction
+    fsync of the rollback journal. Writers take the lock up front with
+    ``BEGIN IMMEDIATE`` and wait up to ``busy_timeout`` for it instead of
+    failing with ``database is locked``.
+    """
+
+    def __init__(self, db_path, busy_timeout=5.0):
+        self.db_path = str(db_path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=128,
+                factory=TimedConnection
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements as one write transaction."""
+        conn = self.connection()
+        if conn.in_transaction:
+            # Nested use joins the outer transaction
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def add_column(self, table, column, declaration):
+        """Add a column to an existing table unless it is already there."""
+        with self.transaction() as conn:
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+    def schema_version(self):
+        return self.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self, version, steps):
+        """Run the schema ``steps`` unless the database is already at ``version``.
+
+        The version is kept in ``PRAGMA user_version``, so a started process
+        pays for one pragma read instead of re-running every CREATE and
+        ALTER. Steps must be idempotent; concurrent workers may both run them.
+        Returns True if the steps ran.
+        """
+        if self.schema_version() >= version:
+            return False
+        for step in steps:
+            step()
+        self.execute(f'PRAGMA user_version = {int(version)}')
+        return True
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            conn.execute(CREATE_VIDEOS)
+            for statement in CREATE_INDEXES:
+                conn.execute(statement)
+            conn.execute(CREATE_SYNC_STATE)
+        self.add_column('videos', 'api_key_id', 'TEXT')
+        self.add_column('videos', 'input_text', 'TEXT')
+        with self.transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'videos_fts'").fetchone()
+            conn.execute(CREATE_VIDEOS_FTS)
+            for statement in CREATE_FTS_TRIGGERS:
+                conn.execute(statement)
+            if not exists:
+                # Index the rows that predate the table
+                conn.execute("INSERT INTO videos_fts (videos_fts) VALUES ('rebuild')")
+        self.add_column('videos', 'avatar_id', 'TEXT')
+        self.add_column('videos', 'dimension', 'TEXT')
+        with self.transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'video_status_history'").fetchone()
+            conn.execute(CREATE_STATUS_HISTORY)
+            conn.execute(CREATE_STATUS_HISTORY_INDEX)
+            for statement in CREATE_STATUS_TRIGGERS:
+                conn.execute(statement)
+            if not exists:
+                # Older rows only have their current status, as of their last update
+                conn.execute('''
+                    INSERT INTO video_status_history (video_id, status, changed_at)
+                    SELECT id, status, COALESCE(updated_at, created_at) FROM videos
+                    WHERE status IS NOT NULL AND COALESCE(updated_at, created_at) IS NOT NULL
+                ''')
+
+    # Reads
+
+    def get(self, video_id):
+        return self.execute(SELECT_VIDEO, (video_id,)).fetchone()
+
+    def api_key_id(self, video_id):
+        """Id of the Heygen key whose account owns the video, if known."""
+        row = self.execute('SELECT api_key_id FROM videos WHERE id = ?', (video_id,)).fetchone()
+        return row['api_key_id'] if row else None
+
+    def get_by_ids(self, video_ids):
+        """Return ``{id: row}`` for the ids that exist."""
+        video_ids = list(video_ids)
+        if not video_ids:
+            return {}
+        placeholders = ','.join('?' * len(video_ids))
+        rows = self.execute(f'SELECT * FROM videos WHERE id IN ({placeholders})', video_ids)
+        return {row['id']: row for row in rows}
+
+    def list_videos(self, offset=0, limit=30, sort='newest', status=None):
+        """Return one page of videos using the created_at/status indexes."""
+        order = VIDEO_SORTS.get(sort, VIDEO_SORTS['newest'])
+        if status:
+            sql = f'SELECT * FROM videos WHERE status = ? ORDER BY {order} LIMIT ? OFFSET ?'
+            params = (status, limit, offset)
+        else:
+            sql = f'SELECT * FROM videos ORDER BY {order} LIMIT ? OFFSET ?'
+            params = (limit, offset)
+        return self.execute(sql, params).fetchall()
+
+    def count_videos(self, status=None):
+        if status:
+            return self.execute('SELECT COUNT(*) FROM videos WHERE status = ?', (status,)).fetchone()[0]
+        return self.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+
+    def status_counts(self):
+        rows = self.execute('SELECT status, COUNT(*) FROM videos GROUP BY status')
+        return {status: count for status, count in rows if status}
+
+    def search_videos(self, q=None, status=None, created_from=None, created_to=None,
+                      newest_first=True, limit=30, after=None):
+        """One keyset page of videos matching the filters.
+
+        ``q`` is matched against titles and scripts through ``videos_fts``;
+        ``created_from``/``created_to`` bound ``created_at`` (ISO strings,
+        ``created_to`` exclusive). ``after`` is the ``(created_at, id)`` of
+        the last row of the previous page, so every page is an index range
+        scan however deep it is. Returns ``(rows, has_more)``.
+        """
+        match = fts_query(q or '')
+        where, params = self._search_filters(match, status, created_from, created_to)
+        if after is not None:
+            where.append('(videos.created_at, videos.id) < (?, ?)' if newest_first
+                         else '(videos.created_at, videos.id) > (?, ?)')
+            params.extend(after)
+        order = 'DESC' if newest_first else 'ASC'
+        limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+        page = f'''
+            SELECT {'videos.rowid' if match else 'videos.*'} FROM videos
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY videos.created_at {order}, videos.id {order}
+            LIMIT ?
+        '''
+        params.append(limit + 1)
+        if match:
+            # Snippets are costly, so only the rows of this page get one
+            page = f'''
+                SELECT videos.*, snippet(videos_fts, -1, '[', ']', '...', 12) AS snippet
+                FROM videos_fts JOIN videos ON videos.rowid = videos_fts.rowid
+                WHERE videos_fts MATCH ? AND videos.rowid IN ({page})
+                ORDER BY videos.created_at {order}, videos.id {order}
+            '''
+            params.insert(0, match)
+        rows = self.execute(page, params).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def search_facets(self, q=None, created_from=None, created_to=None):
+        """Match counts by status and by month for the same search, ignoring any status filter."""
+        match = fts_query(q or '')
+        where, params = self._search_filters(match, None, created_from, created_to)
+        clause = 'WHERE ' + ' AND '.join(where) if where else ''
+        # One pass over the matches, folded into both facets here
+        rows = self.execute(
+            f'SELECT status, substr(created_at, 1, 7) AS month, COUNT(*) FROM videos {clause} '
+            f'GROUP BY status, month ORDER BY month DESC', params)
+        facets = {'status': {}, 'month': {}}
+        for status, month, count in rows:
+            if status:
+                facets['status'][status] = facets['status'].get(status, 0) + count
+            if month:
+                facets['month'][month] = facets['month'].get(month, 0) + count
+        return facets
+
+    def _search_filters(self, match, status, created_from, created_to):
+        where, params = [], []
+        if match:
+            # As a rowid set rather than a join, so status and date filters
+            # can still walk idx_videos_status_created_at
+            where.append('videos.rowid IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)')
+            params.append(match)
+        if status:
+            where.append('videos.status = ?')
+            params.append(status)
+        if created_from:
+            where.append('videos.created_at >= ?')
+            params.append(created_from)
+        if created_to:
+            where.append('videos.created_at < ?')
+            params.append(created_to)
+        return where, params
+
+    def get_state(self, key, default=None):
+        row = self.execute(SELECT_STATE, (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, key, value):
+        with self.transaction() as conn:
+            conn.execute(UPSERT_STATE, (key, value, datetime.now().isoformat()))
+
+    def list_non_terminal(self):
+        """Rows the status poller should track."""
+        return self.execute(SELECT_NON_TERMINAL, UNPOLLED_STATUSES).fetchall()
+
+    # Writes
+
+    def insert_video(self, video_id, name, status, input_text=None, avatar_id=None, dimension=None):
+        now = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.execute(INSERT_VIDEO, (video_id, name, status, input_text, avatar_id, dimension, now, now))
+
+    def upsert_videos(self, videos):
+        """Insert or refresh videos seen in the upstream list.
+
+        ``videos`` holds dicts with id, name, status, thumbnail_url,
+        video_url, created_at and optionally api_key_id; names of existing
+        rows are kept unless they have none, and rows whose status and urls
+        are unchanged are not rewritten. All rows go
+        in one transaction. Returns the number of rows inserted or changed.
+        """
+        now = datetime.now().isoformat()
+        rows = [dict({'api_key_id': None}, **video, updated_at=now) for video in videos]
+        if not rows:
+            return 0
+        with self.transaction() as conn:
+            # rowcount, unlike total_changes, leaves out the search and history triggers
+            return conn.executemany(UPSERT_VIDEO, rows).rowcount
+
+    def update_status(self, video_id, status, video_url, thumbnail_url=None, duration=None, error=None):
+        self.update_statuses([(video_id, status, video_url, thumbnail_url, duration, error)])
+
+    def update_statuses(self, updates):
+        """Apply many ``(id, status, video_url, thumbnail_url, duration, error)`` updates at once.
+
+        ``None`` for thumbnail_url, duration or error keeps the stored value.
+        """
+        now = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.executemany(UPDATE_STATUS, [
+                (status, video_url, thumbnail_url, duration, error, now, video_id)
+                for video_id, status, video_url, thumbnail_url, duration, error in updates
+            ])
+
+    def promote_queued_video(self, placeholder_id, video_id, status='PROCESSING', api_key_id=None):
+        """Give a queued placeholder row the id Heygen assigned to it."""
+        with self.transaction() as conn:
+            if conn.execute('SELECT 1 FROM videos WHERE id = ?', (video_id,)).fetchone():
+                # The list sync already stored the video; keep the placeholder's title
+                conn.execute(MERGE_QUEUED_NAME, {'placeholder': placeholder_id, 'api_key_id': api_key_id,
+                                                 'video_id': video_id})
+                # Keep the time spent queued in the video's history
+                conn.execute('UPDATE video_status_history SET video_id = ? WHERE video_id = ?',
+                             (video_id, placeholder_id))
+                conn.execute('DELETE FROM videos WHERE id = ?', (placeholder_id,))
+                return
+            conn.execute(PROMOTE_QUEUED_VIDEO, (video_id, status, api_key_id, datetime.now().isoformat(),
+                                                placeholder_id))
+
+    def mark_failed(self, video_id, error):
+        with self.transaction() as conn:
+            conn.execute(MARK_FAILED, ('FAILED', error, datetime.now().isoformat(), video_id))
+
+    def update_name(self, video_id, name):
+        with self.transaction() as conn:
+            conn.execute(UPDATE_NAME, (name, datetime.now().isoformat(), video_id))
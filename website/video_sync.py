@@ -0,0 +1,168 @@
+"""Sync of the upstream Heygen video list into videos.db."""
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_PAGES = 100
+
+WATERMARK_KEY = 'video_list_watermark'
+# Re-read videos this much older than the watermark so late status changes
+# near the boundary are not missed; older in-flight videos are covered by
+# the status poller.
+WATERMARK_OVERLAP = 3600
+
+
+def upstream_video_row(video, account=None):
+    """Convert one ``v1/video.list`` entry into a videos.db row, or None."""
+    video_id = video.get('video_id')
+    if not video_id:
+        return None
+
+    created_timestamp = video.get('created_at')
+    if isinstance(created_timestamp, (int, float)):
+        created_at = datetime.fromtimestamp(created_timestamp).isoformat()
+    else:
+        created_at = datetime.now().isoformat()
+
+    return {
+        'id': video_id,
+        'name': f"Video {video_id}",
+        'status': (video.get('status') or 'PROCESSING').upper(),
+        'thumbnail_url': video.get('thumbnail_url') or '',
+        'video_url': video.get('video_url') or '',
+        'created_at': created_at,
+        'api_key_id': account,
+    }
+
+
+class VideoListSync:
+    """Pulls the upstream video history into videos.db in the background.
+
+    The first run follows ``video.list`` pagination tokens across the whole
+    history. Later runs stop at the page that reaches the newest
+    ``created_at`` seen before (the watermark, kept in ``sync_state``).
+    Each run writes everything it saw with one bulk upsert.
+
+    With several Heygen accounts, ``accounts`` lists their key ids. Each
+    account has its own history and watermark, and its rows are stored
+    with its key id as ``api_key_id``.
+    """
+
+    def __init__(self, store, fetch_page, page_size=DEFAULT_PAGE_SIZE,
+                 max_pages=DEFAULT_MAX_PAGES, interval=60, accounts=(None,)):
+        # fetch_page(token, limit, account) -> the 'data' object of a video.list response
+        self.store = store
+        self.fetch_page = fetch_page
+        self.accounts = list(accounts)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.interval = interval
+
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.last_synced_at = None
+        self.last_error = None
+
+    def fetch_all(self, stop_before=None, account=None):
+        """Return upstream videos as ``(rows, newest_created_timestamp)``.
+
+        With ``stop_before`` set, paging stops after the first page holding
+        a video created before that timestamp.
+        """
+        rows = []
+        newest = None
+        token = None
+        for _ in range(self.max_pages):
+            data = self.fetch_page(token, self.page_size, account)
+            reached_watermark = False
+            for video in data.get('videos', []) or []:
+                row = upstream_video_row(video, account)
+                if not row:
+                    continue
+                rows.append(row)
+                created = video.get('created_at')
+                if isinstance(created, (int, float)):
+                    newest = created if newest is None else max(newest, created)
+                    if stop_before is not None and created < stop_before:
+                        reached_watermark = True
+            token = data.get('token')
+            if not token or reached_watermark:
+                break
+        return rows, newest
+
+    def sync(self, full=False):
+        """Fetch new upstream videos and store them; return ``(rows, changed_count)``.
+
+        An account that fails does not hold back the others; its error is
+        raised after their videos are stored.
+        """
+        with self._sync_lock:
+            rows = []
+            watermarks = {}
+            error = None
+            for account in self.accounts:
+                state_key = f'{WATERMARK_KEY}:{account}' if account else WATERMARK_KEY
+                watermark = None if full else self.store.get_state(state_key)
+                stop_before = float(watermark) - WATERMARK_OVERLAP if watermark else None
+                try:
+                    account_rows, newest = self.fetch_all(stop_before, account)
+                except Exception as e:
+                    error = error or e
+                    continue
+                rows.extend(account_rows)
+                if newest is not None and (watermark is None or newest > float(watermark)):
+                    watermarks[state_key] = str(newest)
+
+            changed = self.store.upsert_videos(rows)
+            for state_key, newest in watermarks.items():
+                self.store.set_state(state_key, newest)
+            if error is not None:
+                self.last_error = str(error)
+                raise error
+            self.last_synced_at = datetime.now()
+            self.last_error = None
+            return rows, changed
+
+    # Background scheduling
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='video-list-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def request_sync(self):
+        """Ask the background thread to sync now instead of at its next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                rows, changed = self.sync()
+                logger.info("Synced %d videos from Heygen (%d new or changed)", len(rows), changed,
+                            extra={'rows': len(rows), 'changed': changed})
+            except Exception as e:
+                logger.warning("Error syncing video list: %s", e)
+            # Never sync more than once every few seconds, even on request
+            self._stop.wait(max(0, 5 - (time.monotonic() - started)))
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,132 @@
+"""Receiver for Heygen webhook callbacks (avatar_video.success / avatar_video.fail)."""
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Heygen event type -> videos.status
+EVENT_STATUSES = {
+    'avatar_video.success': 'COMPLETED',
+    'avatar_video.fail': 'FAILED',
+}
+
+CREATE_WEBHOOK_EVENTS = '''
+    CREATE TABLE IF NOT EXISTS webhook_events (
+        event_key TEXT PRIMARY KEY,
+        event_type TEXT NOT NULL,
+        video_id TEXT NOT NULL,
+        received_at TIMESTAMP
+    )
+'''
+
+INSERT_EVENT = '''
+    INSERT INTO webhook_events (event_key, event_type, video_id, received_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(event_key) DO NOTHING
+'''
+
+# Videos submitted elsewhere may not be in videos.db yet; they get the same
+# placeholder title the list sync gives them, and existing titles are kept
+APPLY_EVENT = '''
+    INSERT INTO videos (id, name, status, video_url, error, created_at, updated_at)
+    VALUES (:id, :name, :status, :video_url, :error, :now, :now)
+    ON CONFLICT(id) DO UPDATE SET
+        status = excluded.status,
+        video_url = COALESCE(excluded.video_url, video_url),
+        error = excluded.error,
+        updated_at = excluded.updated_at
+'''
+
+
+class WebhookError(Exception):
+    """Raised for a delivery that must be rejected."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sign(secret, body):
+    """Hex HMAC-SHA256 of the raw body, as sent in the ``Signature`` header."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class WebhookReceiver:
+    """Verifies, deduplicates and applies Heygen video events.
+
+    Each delivery is checked against ``secret`` before its JSON is parsed.
+    An event is identified by its type and video id, so redeliveries and
+    replays of the same outcome are acknowledged without touching the
+    video again. Recording the event and updating the ``videos`` row
+    happen in one transaction.
+
+    ``on_change(list of {'id', 'status', 'video_url'})`` runs after an
+    event changed a video.
+    """
+
+    def __init__(self, store, secret, on_change=None):
+        self.store = store
+        self.secret = secret
+        self.on_change = on_change
+
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def init_schema(self):
+        with self.store.transaction() as conn:
+            conn.execute(CREATE_WEBHOOK_EVENTS)
+
+    @property
+    def enabled(self):
+        return bool(self.secret)
+
+    def handle(self, body, signature):
+        """Process one delivery; returns ``{'status': ..., 'video_id': ...}``."""
+        if not self.enabled:
+            raise WebhookError("Webhooks are not configured", 404)
+        if not signature or not hmac.compare_digest(sign(self.secret, body), signature.strip().lower()):
+            self.rejected += 1
+            raise WebhookError("Invalid signature", 401)
+
+        try:
+            event = json.loads(body)
+            event_type = event['event_type']
+            data = event.get('event_data') or {}
+            video_id = data['video_id']
+        except (ValueError, TypeError, KeyError):
+            self.rejected += 1
+            raise WebhookError("Malformed event")
+
+        self.received += 1
+        status = EVENT_STATUSES.get(event_type)
+        if status is None:
+            return {'status': 'ignored', 'video_id': video_id}
+
+        change = {
+            'id': video_id,
+            'name': f"Video {video_id}",
+            'status': status,
+            'video_url': data.get('url') or None,
+            'error': data.get('msg') if status == 'FAILED' else None,
+            'now': datetime.now().isoformat(),
+        }
+        with self.store.transaction() as conn:
+            before = conn.total_changes
+            conn.execute(INSERT_EVENT, (f'{event_type}:{video_id}', event_type, video_id, change['now']))
+            if conn.total_changes == before:
+                self.duplicates += 1
+                return {'status': 'duplicate', 'video_id': video_id}
+            conn.execute(APPLY_EVENT, change)
+
+        logger.info("Webhook %s for video %s", event_type, video_id,
+                    extra={'video_id': video_id, 'event_type': event_type})
+        if self.on_change:
+            self.on_change([{'id': video_id, 'status': status, 'video_url': change['video_url'] or ''}])
+        return {'status': 'applied', 'video_id': video_id}
+
+    def stats(self):
+        return {'received': self.received, 'duplicates': self.duplicates, 'rejected': self.rejected}